@@ -0,0 +1,302 @@
+import argparse
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import secrets
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+logger = logging.getLogger(__name__)
+
+# Длина сохраняемых строковых полей (текст запроса обрезается)
+MAX_FIELD_LENGTH = 100
+
+
+def _dumps(record):
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+
+
+# Идентификатор чата в событиях: хэш с секретным ключом вместо самого chat_id
+# (без ключа небольшое пространство chat_id легко перебрать)
+def chat_hash(chat_id, key):
+    return hashlib.blake2b(str(chat_id).encode('utf-8'), digest_size=8, key=key).hexdigest()
+
+
+# Ключ хэширования chat_id из секрета (ANALYTICS_SALT). Без секрета ключ
+# случайный для процесса: чаты не сопоставляются между воркерами и перезапусками
+def chat_hash_key(salt):
+    if not salt:
+        logger.warning("ANALYTICS_SALT не задан: chat_id хэшируются случайным ключом процесса")
+        return secrets.token_bytes(32)
+    return hashlib.sha256(salt.encode('utf-8')).digest()
+
+
+# Хранилище событий: JSONL, дописываемый пачками под flock
+# (файл могут дописывать несколько процессов gunicorn)
+class JsonlEventSink:
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, events):
+        data = "".join(_dumps(event) + "\n" for event in events).encode('utf-8')
+        with open(self.path, 'ab') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.write(data)
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def read(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+        except FileNotFoundError:
+            return
+
+
+# Хранилище событий в SQLite (WAL, общая для процессов на хосте)
+class SqliteEventSink:
+    def __init__(self, path):
+        self.path = path
+        self._connection = None
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS events ("
+                "ts REAL NOT NULL, type TEXT NOT NULL, payload TEXT NOT NULL)"
+            )
+
+    def _connect(self):
+        if self._connection is None:
+            # Пишет только поток сброса, читает - команда отчета
+            self._connection = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+        return self._connection
+
+    def write(self, events):
+        with self._connect() as connection:
+            connection.executemany(
+                "INSERT INTO events (ts, type, payload) VALUES (?, ?, ?)",
+                [(event["ts"], event["type"], _dumps(event)) for event in events],
+            )
+
+    def read(self):
+        for (payload,) in self._connect().execute("SELECT payload FROM events ORDER BY ts"):
+            yield json.loads(payload)
+
+
+def create_event_sink(url):
+    if url.startswith("jsonl:///"):
+        return JsonlEventSink(url[len("jsonl:///"):])
+    if url.startswith("sqlite:///"):
+        return SqliteEventSink(url[len("sqlite:///"):])
+    raise ValueError(f"Неизвестное хранилище событий: {url}")
+
+
+# Сбор событий аналитики.
+# record() только добавляет событие в кольцевой буфер в памяти (при
+# переполнении вытесняются самые старые); фоновый поток раз в flush_interval
+# забирает накопленное и пишет одной пачкой. Без sink события не сохраняются.
+class EventRecorder:
+    def __init__(self, sink, capacity=10000, flush_interval=2.0, salt=None):
+        self.sink = sink
+        self._chat_key = chat_hash_key(salt) if sink is not None else None
+        self.flush_interval = flush_interval
+        self._buffer = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {"recorded": 0, "written": 0, "dropped": 0, "write_errors": 0}
+
+    def start(self):
+        if self.sink is None or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="analytics-flush", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.flush_interval + 5)
+        self.flush()
+
+    def record(self, event_type, chat_id=None, **fields):
+        if self.sink is None:
+            return
+        event = {"ts": round(time.time(), 3), "type": event_type}
+        if chat_id is not None:
+            event["chat"] = chat_hash(chat_id, self._chat_key)
+        for name, value in fields.items():
+            event[name] = value[:MAX_FIELD_LENGTH] if isinstance(value, str) else value
+        with self._lock:
+            if len(self._buffer) == self._buffer.maxlen:
+                self._stats["dropped"] += 1
+            self._buffer.append(event)
+            self._stats["recorded"] += 1
+
+    def flush(self):
+        with self._lock:
+            events = list(self._buffer)
+            self._buffer.clear()
+        if not events:
+            return
+        try:
+            self.sink.write(events)
+        except Exception as e:
+            with self._lock:
+                self._stats["write_errors"] += 1
+            logger.error(f"Ошибка записи событий аналитики ({len(events)} шт.): {e}")
+            return
+        with self._lock:
+            self._stats["written"] += len(events)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, buffered=len(self._buffer))
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+
+def create_event_recorder(url, capacity=10000, flush_interval=2.0, salt=None):
+    sink = None if url in ("", "none") else create_event_sink(url)
+    return EventRecorder(sink, capacity=capacity, flush_interval=flush_interval, salt=salt)
+
+
+def _query_key(text):
+    return " ".join(str(text).lower().split())
+
+
+# Сводка по событиям: популярные вопросы и категории, запросы без результатов,
+# конверсия заявок (начатые/отправленные)
+def aggregate(events):
+    questions = Counter()
+    categories = Counter()
+    queries = Counter()
+    zero_result = Counter()
+    searches = 0
+    zero_results = 0
+    started = set()
+    submitted = set()
+    programs = Counter()
+    for event in events:
+        event_type = event.get("type")
+        if event_type == "question_view":
+            questions[event["question_id"]] += 1
+        elif event_type == "category_open":
+            categories[event["category"]] += 1
+        elif event_type == "search":
+            searches += 1
+            if not event.get("results"):
+                zero_results += 1
+            # Текст свободных вопросов без результатов не сохраняется
+            if "query" not in event:
+                continue
+            key = _query_key(event["query"])
+            if event.get("results"):
+                queries[key] += 1
+            else:
+                zero_result[key] += 1
+        elif event_type == "application_start":
+            started.add(event.get("chat"))
+        elif event_type == "application_submit":
+            submitted.add(event.get("chat"))
+            programs[event.get("program")] += 1
+    return {
+        "questions": questions,
+        "categories": categories,
+        "queries": queries,
+        "zero_result_queries": zero_result,
+        "searches": searches,
+        "zero_results": zero_results,
+        "applications": {
+            "started": len(started),
+            "submitted": len(submitted),
+            "conversion": round(len(submitted & started) / len(started), 3) if started else 0.0,
+            "programs": dict(programs),
+        },
+    }
+
+
+# Файл популярности для бота: просмотры вопросов (порядок в меню)
+# и частые запросы с результатами (прогрев кэша поиска)
+def write_popularity(summary, path, top_queries=200):
+    popularity = {
+        "generated_at": round(time.time()),
+        "questions": {str(question_id): count for question_id, count in summary["questions"].items()},
+        "queries": [query for query, _ in summary["queries"].most_common(top_queries)],
+    }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(popularity, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return popularity
+
+
+# Популярность для бота; пустая, если файла нет или он поврежден
+def load_popularity(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            popularity = json.load(f)
+    except FileNotFoundError:
+        return {"questions": {}, "queries": []}
+    except (OSError, ValueError) as e:
+        logger.error(f"Ошибка чтения {path}: {e}")
+        return {"questions": {}, "queries": []}
+    return {
+        "questions": {int(question_id): count for question_id, count in popularity.get("questions", {}).items()},
+        "queries": list(popularity.get("queries", [])),
+    }
+
+
+def print_report(summary, faq=None, top=10):
+    def question_title(question_id):
+        question = faq.question(question_id) if faq is not None else None
+        return question.question if question is not None else f"#{question_id}"
+
+    print(f"Поисковых запросов: {summary['searches']}, без результатов: {summary['zero_results']}")
+    print(f"\nПопулярные вопросы (top {top}):")
+    for question_id, count in summary["questions"].most_common(top):
+        print(f"{count:>7}  {question_title(question_id)}")
+    print(f"\nЗапросы без результатов (top {top}):")
+    for query, count in summary["zero_result_queries"].most_common(top):
+        print(f"{count:>7}  {query}")
+    applications = summary["applications"]
+    print(f"\nЗаявки: начато {applications['started']}, отправлено {applications['submitted']}, "
+          f"конверсия {applications['conversion']:.1%}, программы: {applications['programs']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Отчет по событиям аналитики бота")
+    parser.add_argument("store", nargs="?", default="jsonl:///analytics_events.jsonl",
+                        help="хранилище событий (jsonl:///path или sqlite:///path)")
+    parser.add_argument("--faq", default="faq.json", help="faq.json для названий вопросов")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--popularity", help="записать файл популярности для бота")
+    args = parser.parse_args()
+
+    summary = aggregate(create_event_sink(args.store).read())
+    faq = None
+    if os.path.exists(args.faq):
+        from faq_model import load_faq_model
+        faq = load_faq_model(args.faq)
+    print_report(summary, faq, args.top)
+    if args.popularity:
+        popularity = write_popularity(summary, args.popularity)
+        print(f"\nФайл популярности {args.popularity}: {len(popularity['questions'])} вопросов, "
+              f"{len(popularity['queries'])} запросов")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
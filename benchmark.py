@@ -0,0 +1,497 @@
+import argparse
+import itertools
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+from callbacks import encode
+from menus import QUESTIONS_PER_PAGE
+
+# Нагрузочный тест вебхука: маршрут get_message вызывается через WSGI
+# синтетическими обновлениями, а Telegram Bot API и Apps Script заменены
+# локальными заглушками с настраиваемой задержкой. В режиме polling
+# обновления отдаются через getUpdates заглушки и обрабатываются PollingRunner.
+#
+#   python benchmark.py --users 200 --concurrency 8 --telegram-latency 30 --output bench.json
+#   python benchmark.py --mode polling --users 200 --concurrency 16
+#   python benchmark.py --mode async --chat-rate 1 --telegram-429 0.1   # лимиты, 429 и повторы
+#   python benchmark.py --compare bench.json
+
+TOKEN = "123456:BENCHMARK"
+
+SEARCH_KEYWORDS = [
+    "отпуск", "отпуска", "денежное довольствие", "льготы", "документы", "поступление",
+    "общежитие", "стипендия", "телефон", "трудоустройство", "форма", "экзамены",
+    "медицинская комиссия", "питание", "увольнение", "связь",
+]
+
+# Вопросы обычным текстом, в том числе с опечатками
+FREE_TEXT_QUESTIONS = [
+    "Есть ли общежитие?", "общежитее", "какие бывают отпуска", "оттпуск", "кто оплачивает обучение",
+    "можно ли учиться на офицера", "какие экзамены нужны", "где находится институт", "привет",
+]
+
+
+# Заглушка HTTP-сервера с фиксированной задержкой ответа.
+# Код ответа берется из error_code ответа (как у Bot API), иначе 200.
+class StubServer:
+    def __init__(self, handler_factory, latency):
+        self.latency = latency
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length)
+                server.requests += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                response = handler_factory(self.path, body)
+                payload = json.dumps(response).encode('utf-8')
+                self.send_response(response.get("error_code", 200) if isinstance(response, dict) else 200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_port
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+
+
+# Очередь обновлений для getUpdates заглушки Bot API (режим --mode polling):
+# обновления с update_id меньше offset считаются подтвержденными и удаляются
+class FakeUpdateQueue:
+    def __init__(self):
+        self.updates = []
+        self.condition = threading.Condition()
+
+    def add(self, update):
+        with self.condition:
+            self.updates.append(update)
+            self.condition.notify_all()
+
+    def get_updates(self, path):
+        params = dict(parse_qsl(urlsplit(path).query))
+        offset = int(params.get('offset', 0))
+        limit = int(params.get('limit', 100))
+        with self.condition:
+            self.updates = [update for update in self.updates if update['update_id'] >= offset]
+            if not self.updates:
+                self.condition.wait(float(params.get('timeout', 0)))
+            return sorted(self.updates, key=lambda update: update['update_id'])[:limit]
+
+
+# Ответ заглушки Bot API. limiter (RateLimitStub) отвечает 429 с retry_after
+# на часть отправок и правок сообщений - для проверки повторов и отложенных вызовов
+def telegram_response(path, body, updates=None, limiter=None):
+    method = path.split('?', 1)[0].rsplit('/', 1)[-1]
+    if limiter is not None and method in ("sendMessage", "editMessageText") and limiter.limited():
+        return {
+            "ok": False, "error_code": 429,
+            "description": f"Too Many Requests: retry after {limiter.retry_after}",
+            "parameters": {"retry_after": limiter.retry_after},
+        }
+    if method == "getUpdates" and updates is not None:
+        result = updates.get_updates(path)
+    elif method in ("sendMessage", "editMessageText"):
+        result = {"message_id": 1, "date": int(time.time()), "chat": {"id": 1, "type": "private"}, "text": ""}
+    elif method == "getMe":
+        result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+    else:
+        result = True
+    return {"ok": True, "result": result}
+
+
+# Доля запросов, на которые заглушка Bot API отвечает 429
+class RateLimitStub:
+    def __init__(self, fraction, retry_after, seed):
+        self.fraction = fraction
+        self.retry_after = retry_after
+        self.responses = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def limited(self):
+        with self._lock:
+            if self._rng.random() >= self.fraction:
+                return False
+            self.responses += 1
+            return True
+
+
+def apps_script_response(path, body):
+    return {"status": "success"}
+
+
+# Генератор синтетических обновлений Telegram
+class UpdateFactory:
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _next(self):
+        with self._lock:
+            return next(self._ids)
+
+    def _user(self, chat_id, username):
+        return {"id": chat_id, "is_bot": False, "first_name": "Курсант", "username": username}
+
+    def message(self, chat_id, text, username="bench_user"):
+        message = {
+            "message_id": self._next(), "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"}, "from": self._user(chat_id, username), "text": text,
+        }
+        if text.startswith('/'):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": self._next(), "message": message}
+
+    def callback(self, chat_id, data, username="bench_user"):
+        return {"update_id": self._next(), "callback_query": {
+            "id": str(self._next()), "chat_instance": str(chat_id), "data": data, "from": self._user(chat_id, username),
+            "message": {"message_id": 1, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"}, "text": "menu"},
+        }}
+
+
+# Сценарии: списки (метка, обновление) для одного пользователя
+def build_scenarios(faq_data, factory, rng):
+    categories = faq_data['categories']
+
+    def start(chat_id):
+        return [("message:/start", factory.message(chat_id, "/start"))]
+
+    def browse(chat_id):
+        cat_index = rng.randrange(len(categories))
+        subcategories = categories[cat_index]['subcategories']
+        subcat_index = rng.randrange(len(subcategories))
+        questions = subcategories[subcat_index]['questions']
+        position = rng.randrange(len(questions))
+        page = position // QUESTIONS_PER_PAGE
+        steps = [
+            ("callback:cat", factory.callback(chat_id, encode("category", cat_index))),
+            ("callback:subcat", factory.callback(chat_id, encode("subcategory", cat_index, subcat_index, 0))),
+        ]
+        if page:
+            steps.append(("callback:page", factory.callback(chat_id, encode("subcategory", cat_index, subcat_index, page))))
+        return steps + [
+            ("callback:q", factory.callback(chat_id, encode("question", questions[position]['id']))),
+            ("callback:back_to_subcat", factory.callback(chat_id, encode("category", cat_index))),
+            ("callback:back_to_categories", factory.callback(chat_id, encode("categories"))),
+        ]
+
+    def search(chat_id):
+        return [
+            ("callback:search", factory.callback(chat_id, encode("search"))),
+            ("message:search_text", factory.message(chat_id, rng.choice(SEARCH_KEYWORDS))),
+        ]
+
+    def ask(chat_id):
+        return [("message:free_text", factory.message(chat_id, rng.choice(FREE_TEXT_QUESTIONS)))]
+
+    def apply(chat_id):
+        return [
+            ("callback:apply", factory.callback(chat_id, encode("apply"))),
+            ("message:fio", factory.message(chat_id, "Иванов Иван Иванович")),
+            ("message:phone", factory.message(chat_id, "+7 951 122 28 90")),
+            ("callback:prog", factory.callback(chat_id, encode("program", "vo"))),
+        ]
+
+    return {"start": start, "browse": browse, "search": search, "ask": ask, "apply": apply}
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def summarize(samples):
+    return {
+        "count": len(samples),
+        "p50_ms": round(percentile(samples, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(samples, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(samples, 0.99) * 1000, 3),
+        "max_ms": round(max(samples) * 1000, 3) if samples else 0.0,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(args):
+    updates = FakeUpdateQueue() if args.mode == "polling" else None
+    limiter = RateLimitStub(args.telegram_429, args.retry_after, args.seed) if args.telegram_429 else None
+    telegram = StubServer(lambda path, body: telegram_response(path, body, updates, limiter), args.telegram_latency / 1000)
+    apps_script = StubServer(apps_script_response, args.apps_script_latency / 1000)
+    workdir = tempfile.mkdtemp(prefix="oabii-bench-")
+    os.environ["TELEGRAM_BOT_TOKEN"] = TOKEN
+    os.environ["APPS_SCRIPT_URL"] = f"http://127.0.0.1:{apps_script.port}/exec"
+    os.environ["APPLICATION_SPOOL"] = os.path.join(workdir, "applications_spool.jsonl")
+    # Синтетические события не должны попадать в аналитику рабочего каталога,
+    # а локальный popularity.json - менять порядок вопросов в измеряемых меню
+    os.environ["ANALYTICS_STORE"] = f"jsonl:///{os.path.join(workdir, 'analytics_events.jsonl')}"
+    os.environ["POPULARITY_PATH"] = os.path.join(workdir, "popularity.json")
+    os.environ["ANALYTICS_SALT"] = "benchmark"
+    # Режим и лимиты задаются только аргументами, а не унаследованным окружением
+    os.environ["WEBHOOK_MODE"] = "sync" if args.mode == "polling" else args.mode
+    os.environ.setdefault("WARM_UP", "0")
+    os.environ["TELEGRAM_CHAT_RATE"] = str(args.chat_rate)
+    os.environ["TELEGRAM_GLOBAL_RATE"] = str(args.global_rate)
+
+    from telebot import apihelper
+    apihelper.API_URL = f"http://127.0.0.1:{telegram.port}/bot{{0}}/{{1}}"
+
+    import logging
+    if args.trace_memory:
+        tracemalloc.start()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    import_started = time.perf_counter()
+    import bot
+    import metrics
+    import_seconds = time.perf_counter() - import_started
+    logging.getLogger().setLevel(logging.WARNING)
+    from werkzeug.test import EnvironBuilder
+
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'faq.json'), encoding='utf-8') as f:
+        faq_data = json.load(f)
+    rng = random.Random(args.seed)
+    factory = UpdateFactory()
+    scenarios = build_scenarios(faq_data, factory, rng)
+    weights = {"start": 2, "browse": 5, "search": 3, "ask": 3, "apply": 1}
+    plan = []
+    for i in range(args.users):
+        chat_id = 10_000 + i
+        names = rng.choices(list(weights), weights=list(weights.values()), k=args.flows)
+        steps = []
+        for name in names:
+            steps.extend(scenarios[name](chat_id))
+        plan.append(steps)
+
+    def post_webhook(update):
+        environ = EnvironBuilder(
+            path=f"/{TOKEN}", method="POST", data=json.dumps(update), content_type="application/json",
+        ).get_environ()
+        status = []
+        body = bot.app(environ, lambda code, headers, exc_info=None: status.append(code))
+        b"".join(body)
+        return status[0]
+
+    post = post_webhook
+    if args.mode == "async":
+        # Вебхук отвечает сразу после постановки в очередь, поэтому "ответ" -
+        # окончание обработки обновления пулом, а не код маршрута
+        handled = {}
+        process_update = bot.dispatcher.process
+
+        def process_async(update):
+            try:
+                process_update(update)
+            finally:
+                handled.pop(update['update_id']).set()
+
+        bot.dispatcher.process = process_async
+
+        def post(update):
+            done = handled[update['update_id']] = threading.Event()
+            status = post_webhook(update)
+            if not status.startswith("200"):
+                handled.pop(update['update_id'], None)
+                return status
+            return "200 OK" if done.wait(30) else "504 TIMEOUT"
+    runner = None
+    if args.mode == "polling":
+        from polling import PollingRunner
+        processed = {}
+
+        def process(update):
+            try:
+                bot.process_update_paced(update)
+            finally:
+                processed[update['update_id']].set()
+
+        def fetch(offset, limit, timeout):
+            return apihelper.get_updates(TOKEN, offset, limit, long_polling_timeout=timeout or 1)
+
+        runner = PollingRunner(process, fetch, workers=int(os.getenv("POLLING_WORKERS", "4")), poll_timeout=1)
+        runner_thread = threading.Thread(target=runner.run, name="polling")
+        runner_thread.start()
+
+        # "Ответ" на обновление - окончание его обработки пулом.
+        # update_id, как и в Telegram, растет в порядке поступления
+        def post(update):
+            update = dict(update, update_id=factory._next())
+            done = processed[update['update_id']] = threading.Event()
+            updates.add(update)
+            return "200 OK" if done.wait(30) else "504 TIMEOUT"
+
+    # Прогрев: поиск и меню до начала замеров
+    for update in (factory.message(1, "/start"), factory.callback(1, encode("search")), factory.message(1, "отпуск")):
+        post(update)
+
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    pending = iter(plan)
+
+    def worker():
+        while True:
+            with lock:
+                steps = next(pending, None)
+            if steps is None:
+                return
+            for label, update in steps:
+                started = time.perf_counter()
+                status = post(update)
+                elapsed = time.perf_counter() - started
+                with lock:
+                    latencies[label].append(elapsed)
+                    if not status.startswith("200"):
+                        errors[label] += 1
+
+    memory_before = tracemalloc.get_traced_memory()[0]
+    rss_warm = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - started
+    memory_after, memory_peak = tracemalloc.get_traced_memory()
+
+    if args.mode == "async":
+        bot.dispatcher.stop()
+    # Отложенные вызовы (sync-режим с лимитами) должны завершиться до подсчета
+    deadline = time.monotonic() + 60
+    while bot.tg.deferred_count() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    polling_stats = None
+    if runner is not None:
+        runner.stop()
+        runner_thread.join()
+        polling_stats = runner.stats()
+
+    all_samples = [sample for samples in latencies.values() for sample in samples]
+    result = {
+        "revision": git_revision(),
+        "config": vars(args),
+        "import_seconds": round(import_seconds, 3),
+        "duration_seconds": round(duration, 3),
+        "updates": len(all_samples),
+        "requests_per_second": round(len(all_samples) / duration, 1) if duration else 0.0,
+        "overall": summarize(all_samples),
+        "by_step": {label: summarize(samples) for label, samples in sorted(latencies.items())},
+        "errors": dict(errors),
+        "telegram_api_calls": telegram.requests,
+        "telegram": {
+            "rate_limited": limiter.responses if limiter else 0,
+            "retries": metrics.TELEGRAM_RETRIES.total(),
+            "deferred": metrics.TELEGRAM_DEFERRED.value(result="deferred"),
+            "deferred_dropped": metrics.TELEGRAM_DEFERRED.value(result="dropped"),
+            "deferred_pending": bot.tg.deferred_count(),
+            "coalesced": metrics.TELEGRAM_COALESCED.total(),
+        },
+        "polling": polling_stats,
+        "memory": {
+            "rss_before_import_kb": rss_before,
+            "rss_after_warmup_kb": rss_warm,
+            "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "traced_growth_kb": round((memory_after - memory_before) / 1024, 1),
+            "traced_peak_kb": round(memory_peak / 1024, 1),
+        },
+    }
+    telegram.close()
+    apps_script.close()
+    return result
+
+
+def print_report(result, baseline=None):
+    print(f"Ревизия {result['revision']}: {result['updates']} обновлений за {result['duration_seconds']} с, "
+          f"{result['requests_per_second']} обновл./с на процесс, импорт {result['import_seconds']} с")
+    memory = result['memory']
+    print(f"Память: max RSS {memory['rss_after_warmup_kb']} -> {memory['max_rss_kb']} КБ за прогон"
+          + (f", tracemalloc: прирост {memory['traced_growth_kb']} КБ, пик {memory['traced_peak_kb']} КБ"
+             if result['config']['trace_memory'] else ""))
+    rows = [("overall", result['overall'])] + list(result['by_step'].items())
+    print(f"{'шаг':<28}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}" + ("   Δp95" if baseline else ""))
+    for label, stats in rows:
+        line = f"{label:<28}{stats['count']:>7}{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}"
+        if baseline:
+            previous = baseline['overall'] if label == "overall" else baseline['by_step'].get(label)
+            if previous and previous['p95_ms']:
+                line += f"   {(stats['p95_ms'] / previous['p95_ms'] - 1) * 100:+.1f}%"
+        print(line)
+    telegram = result.get('telegram')
+    if telegram and (telegram['rate_limited'] or telegram['deferred'] or telegram['coalesced']):
+        print(f"Bot API: 429 - {telegram['rate_limited']}, повторов {telegram['retries']}, "
+              f"отложено {telegram['deferred']} (отброшено {telegram['deferred_dropped']}, "
+              f"не выполнено {telegram['deferred_pending']}), отброшено лишних {telegram['coalesced']}")
+    if result['errors']:
+        print(f"Ошибки: {result['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест вебхука бота")
+    parser.add_argument("--users", type=int, default=100, help="число синтетических пользователей")
+    parser.add_argument("--flows", type=int, default=3, help="сценариев на пользователя")
+    parser.add_argument("--concurrency", type=int, default=4, help="параллельных потоков-клиентов")
+    parser.add_argument("--telegram-latency", type=float, default=0, help="задержка заглушки Bot API, мс")
+    parser.add_argument("--apps-script-latency", type=float, default=0, help="задержка заглушки Apps Script, мс")
+    # Лимиты исходящих вызовов по умолчанию сняты: замеряется собственная стоимость обработки
+    parser.add_argument("--chat-rate", type=float, default=100000, help="лимит вызовов Bot API в секунду на чат")
+    parser.add_argument("--global-rate", type=float, default=100000, help="общий лимит вызовов Bot API в секунду")
+    parser.add_argument("--telegram-429", type=float, default=0,
+                        help="доля отправок и правок, на которые Bot API отвечает 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after в ответах 429, с")
+    parser.add_argument("--mode", choices=("sync", "async", "polling"), default="sync",
+                        help="режим вебхука или long polling через getUpdates")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--trace-memory", action="store_true", help="учет выделений через tracemalloc (медленнее)")
+    parser.add_argument("--output", help="сохранить результат в JSON")
+    parser.add_argument("--compare", help="JSON предыдущего запуска для сравнения")
+    args = parser.parse_args()
+
+    result = run(args)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    return 1 if result['errors'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
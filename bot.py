@@ -1,17 +1,36 @@
+import time
+IMPORT_STARTED = time.perf_counter()
+
 import telebot
+from telebot import apihelper
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
-from flask import Flask, request
+from flask import Flask, Response, request
 import os
-import logging
+import atexit
 import json
+import logging
 import re
-import requests
-import pymorphy3
+import threading
+from lemmatizer import normal_form, cache_stats
+from faq_runtime import FaqRuntime
+from menus import escape_markdown, render_search_results
+from callbacks import decode as decode_callback, encode as encode_callback
+from query_answers import QueryAnswerer
+from analytics import create_event_recorder, load_popularity
+from submission import ApplicationSubmitter
+from dispatcher import UpdateDispatcher
+from state_store import create_state_store
+from telegram_client import TelegramSender, TelegramSession
+import metrics
+from metrics import instrumented, log_sampled
 
 # Настройка логирования
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Время импорта и первого ответа (для оценки холодного старта)
+startup_timings = {}
+
 # Инициализация Flask
 app = Flask(__name__)
 
@@ -28,104 +47,130 @@ except Exception as e:
     logger.error(f"Ошибка инициализации бота: {e}")
     raise
 
+# Адрес Bot API в формате apihelper (например, локальная заглушка: http://127.0.0.1:8081/bot{0}/{1})
+if os.getenv("TELEGRAM_API_URL"):
+    apihelper.API_URL = os.getenv("TELEGRAM_API_URL")
+
+# Исходящие вызовы Bot API: общая keep-alive сессия, лимиты, повторы после 429
+apihelper.CUSTOM_REQUEST_SENDER = TelegramSession(pool_size=int(os.getenv("TELEGRAM_POOL_SIZE", "16"))).request
+tg = TelegramSender(
+    bot,
+    global_rate=float(os.getenv("TELEGRAM_GLOBAL_RATE", "30")),
+    chat_rate=float(os.getenv("TELEGRAM_CHAT_RATE", "1")),
+    chat_burst=int(os.getenv("TELEGRAM_CHAT_BURST", "3")),
+)
+
+# Поиск: keyword - по леммам (BM25, опечатки), semantic - LSA по артефакту
+# из semantic_search.py (нужен numpy; без артефакта - поиск по леммам)
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "keyword")
+
+# Популярность вопросов и запросов (python analytics.py --popularity popularity.json)
+popularity = load_popularity(os.getenv("POPULARITY_PATH", "popularity.json"))
+
 # Загрузка FAQ
 try:
-    with open('faq.json', 'r', encoding='utf-8') as f:
-        faq_data = json.load(f)
-    logger.info("FAQ успешно загружен")
+    faq_runtime = FaqRuntime(
+        'faq.json',
+        normal_form,
+        snapshot_path=os.getenv("FAQ_SNAPSHOT", "faq.snapshot"),
+        semantic_dir=os.getenv("SEMANTIC_INDEX_DIR", "faq_semantic") if SEARCH_BACKEND == "semantic" else None,
+        popularity=popularity["questions"],
+    )
+    faq_runtime.load()
+    logger.info(f"FAQ успешно загружен: {len(faq_runtime.current.faq.questions_by_id)} вопросов")
 except Exception as e:
     logger.error(f"Ошибка загрузки faq.json: {e}")
     raise
 
-# Инициализация pymorphy3
-morph = pymorphy3.MorphAnalyzer()
+# Слежение за faq.json (интервал в секундах, 0 - отключено): одна проверка
+# времени модификации за интервал; через него же /reload доходит до всех воркеров
+faq_runtime.start_watcher(int(os.getenv("FAQ_WATCH_INTERVAL", "5")))
+
+# Прогрев pymorphy3 и поискового индекса в фоне (иначе - при первом поиске)
+if os.getenv("WARM_UP", "1") == "1":
+    faq_runtime.start_warm_up()
 
 # URL Apps Script
-APPS_SCRIPT_URL = 'https://script.google.com/macros/s/AKfycbyNhhsqtMavUkSN0SvgmiZZMKsWkorAidfrQ5bulQB0KtA3iM8zBp7-Es8TdQOGe9Dkww/exec'
+APPS_SCRIPT_URL = os.getenv("APPS_SCRIPT_URL", 'https://script.google.com/macros/s/AKfycbyNhhsqtMavUkSN0SvgmiZZMKsWkorAidfrQ5bulQB0KtA3iM8zBp7-Es8TdQOGe9Dkww/exec')
+
+# Фоновая отправка заявок (спул на диске, повторы, пачки)
+submitter = ApplicationSubmitter(
+    APPS_SCRIPT_URL,
+    os.getenv("APPLICATION_SPOOL", "applications_spool.jsonl"),
+    batch_size=int(os.getenv("APPS_SCRIPT_BATCH_SIZE", "1")),
+)
+submitter.start()
+
+# События аналитики: буфер в памяти, запись пачками в фоновом потоке.
+# ANALYTICS_STORE=sqlite:///analytics.sqlite3, none - не сохранять.
+# ANALYTICS_SALT - секрет для хэширования chat_id (общий для всех воркеров)
+analytics = create_event_recorder(
+    os.getenv("ANALYTICS_STORE", "jsonl:///analytics_events.jsonl"),
+    flush_interval=float(os.getenv("ANALYTICS_FLUSH_INTERVAL", "2")),
+    salt=os.getenv("ANALYTICS_SALT"),
+)
+analytics.start()
+atexit.register(analytics.stop)
+
+# Состояние диалогов (шаг и данные заявки) с истечением по TTL.
+# STATE_STORE=sqlite:///state.sqlite3 - общее хранилище для нескольких воркеров
+state_store = create_state_store(os.getenv("STATE_STORE", "memory"), ttl=int(os.getenv("STATE_TTL", "3600")))
+
+# Часто используемые тексты, экранированные заранее
+ERROR_TEXT = escape_markdown("❌ Произошла ошибка.")
+SEARCH_PROMPT_TEXT = escape_markdown("🔍 Введи ключевое слово для поиска:")
+
+# Кнопки категорий
+def create_category_buttons():
+    return faq_runtime.current.menus.categories.markup
 
-# Хранение данных заявок
-user_data_storage = {}
+# Индексы, по которым ищет текущий снимок FAQ: по леммам (точнее
+# на формулировках из FAQ и исправляет опечатки); семантический
+# переупорядочивает результаты, если по леммам уверенного ответа нет
+def search_backend(snapshot):
+    if SEARCH_BACKEND == "semantic":
+        index = snapshot.semantic_index
+        if index is not None:
+            return snapshot.search_index, index
+    return (snapshot.search_index,)
 
-# Экранирование специальных символов для MarkdownV2
-def escape_markdown(text):
-    special_chars = r'[_*[\]()~`>#+-=|{}.!]'
-    return re.sub(special_chars, r'\\\g<0>', str(text))
+# Поиск вопросов с кэшем по нормализованному запросу
+answerer = QueryAnswerer(normal_form, cache_size=int(os.getenv("SEARCH_CACHE_SIZE", "2000")), backend=search_backend)
 
-# Создание кнопок для категорий
-def create_category_buttons():
-    markup = InlineKeyboardMarkup()
-    for i, category in enumerate(faq_data['categories']):
-        markup.add(InlineKeyboardButton(f"📚 {category['name']}", callback_data=f"cat_{i}"))
-    markup.add(InlineKeyboardButton("🔍 Поиск по ключевому слову", callback_data="search"))
-    logger.info(f"Созданы кнопки категорий: {[cat['name'] for cat in faq_data['categories']]}")
-    return markup
-
-# Создание кнопок для подкатегорий
-def create_subcategory_buttons(cat_index):
-    markup = InlineKeyboardMarkup()
-    try:
-        category = faq_data['categories'][cat_index]
-        for i, subcategory in enumerate(category['subcategories']):
-            markup.add(InlineKeyboardButton(f"📌 {subcategory['name']}", callback_data=f"subcat_{cat_index}_{i}"))
-        if category['name'] == "Абитуриенту":
-            markup.add(InlineKeyboardButton("📋 Оставить заявку", callback_data="apply"))
-        markup.add(InlineKeyboardButton("⬅️ Назад", callback_data="back_to_categories"))
-        logger.info(f"Созданы кнопки подкатегорий для {category['name']}")
-    except IndexError:
-        logger.error(f"Неверный индекс категории: {cat_index}")
-    return markup
+def search_questions(keyword):
+    with metrics.SEARCH_SECONDS.time():
+        return answerer.search(faq_runtime.current, keyword)
 
-# Создание кнопок вопросов
-def create_question_buttons(cat_index, subcat_index):
-    markup = InlineKeyboardMarkup()
+# Прогрев кэша поиска частыми запросами из аналитики
+def warm_up_search(queries):
     try:
-        subcategory = faq_data['categories'][cat_index]['subcategories'][subcat_index]
-        for i, question in enumerate(subcategory['questions'][:5], 1):
-            markup.add(InlineKeyboardButton(f"❓ Вопрос {i}", callback_data=f"q_{question['id']}"))
-        markup.add(InlineKeyboardButton("⬅️ Назад", callback_data=f"back_to_subcat_{cat_index}"))
-        logger.info(f"Созданы кнопки вопросов для {subcategory['name']}")
-    except IndexError:
-        logger.error(f"Неверный индекс: cat_index={cat_index}, subcat_index={subcat_index}")
-    return markup
-
-# Форматирование текста вопросов
-def get_questions_text(cat_index, subcat_index):
-    try:
-        subcategory = faq_data['categories'][cat_index]['subcategories'][subcat_index]
-        text = f"✨ *{escape_markdown(subcategory['name'])}*\n\n"
-        for i, question in enumerate(subcategory['questions'][:5], 1):
-            text += f"_{i}\\. {escape_markdown(question['question'])} ❓_\n"
-        text += "\nВыберите номер вопроса или вернитесь назад\\."
-        return text
-    except IndexError:
-        logger.error(f"Неверный индекс: cat_index={cat_index}, subcat_index={subcat_index}")
-        return "❌ Ошибка: категория не найдена."
-
-# Поиск вопросов
-def search_questions(keyword):
-    results = []
-    normalized_keyword = morph.parse(keyword)[0].normal_form
-    for category in faq_data['categories']:
-        for subcategory in category['subcategories']:
-            for question in subcategory['questions']:
-                question_words = question['question'].split()
-                answer_words = question['answer'].split()
-                for word in question_words + answer_words:
-                    normalized_word = morph.parse(word)[0].normal_form
-                    if normalized_keyword in normalized_word:
-                        results.append(question)
-                        break
-    return results[:5]
+        for query in queries:
+            search_questions(query)
+        logger.info(f"Кэш поиска прогрет: {len(queries)} запросов")
+    except Exception as e:
+        logger.error(f"Ошибка прогрева кэша поиска: {e}")
+
+if os.getenv("WARM_UP", "1") == "1" and popularity["queries"]:
+    threading.Thread(target=warm_up_search, args=(popularity["queries"],), name="search-warm-up", daemon=True).start()
+
+def reply_not_found(message, keyword):
+    tg.reply_to(
+        message,
+        escape_markdown(f"😕 Не могу знать, в моей базе знаний отсутствует информация по запросу *{keyword}*."),
+        reply_markup=create_category_buttons(),
+        parse_mode='MarkdownV2'
+    )
 
 # Обработка /start
 @bot.message_handler(commands=['start'])
 def send_welcome(message):
     try:
-        logger.info(f"Получена команда /start от {message.chat.id}")
+        log_sampled(logger, "Получена команда /start от %s", message.chat.id)
+        state_store.delete(message.chat.id)
         user_name = message.from_user.first_name or message.from_user.username or "Курсант"
         if user_name.startswith('@'):
             user_name = user_name[1:]  # Убираем @ для красоты
-        bot.reply_to(
+        tg.reply_to(
             message,
             escape_markdown(f"Здравия желаю, {user_name}! 👋 Я Ассистент курсанта по вопросам обучения. Выбери категорию:"),
             reply_markup=create_category_buttons(),
@@ -140,11 +185,11 @@ def send_test(message):
     try:
         logger.info(f"Получена команда /test от {message.chat.id}")
         markup = InlineKeyboardMarkup()
-        markup.add(InlineKeyboardButton("✅ Вопрос 1: Да", callback_data="q1_yes"))
-        markup.add(InlineKeyboardButton("❌ Вопрос 1: Нет", callback_data="q1_no"))
-        markup.add(InlineKeyboardButton("👍 Вопрос 2: Хорошо", callback_data="q2_good"))
-        markup.add(InlineKeyboardButton("👎 Вопрос 2: Плохо", callback_data="q2_bad"))
-        bot.reply_to(
+        markup.add(InlineKeyboardButton("✅ Вопрос 1: Да", callback_data=encode_callback("test", "q1_yes")))
+        markup.add(InlineKeyboardButton("❌ Вопрос 1: Нет", callback_data=encode_callback("test", "q1_no")))
+        markup.add(InlineKeyboardButton("👍 Вопрос 2: Хорошо", callback_data=encode_callback("test", "q2_good")))
+        markup.add(InlineKeyboardButton("👎 Вопрос 2: Плохо", callback_data=encode_callback("test", "q2_bad")))
+        tg.reply_to(
             message,
             escape_markdown("🧪 Выбери ответ на тестовый вопрос:"),
             reply_markup=markup,
@@ -157,36 +202,66 @@ def send_test(message):
 @bot.message_handler(commands=['search'])
 def start_search(message):
     try:
-        logger.info(f"Получена команда /search от {message.chat.id}")
-        bot.reply_to(message, escape_markdown("🔍 Введи ключевое слово для поиска:"), parse_mode='MarkdownV2')
-        bot.register_next_step_handler(message, process_search)
+        log_sampled(logger, "Получена команда /search от %s", message.chat.id)
+        tg.reply_to(message, SEARCH_PROMPT_TEXT, parse_mode='MarkdownV2')
+        state_store.set(message.chat.id, {"step": "search"})
     except Exception as e:
         logger.error(f"Ошибка при обработке /search: {e}")
 
 # Обработка поиска
-def process_search(message):
+@instrumented("process_search")
+def process_search(message, state=None):
     try:
+        state_store.delete(message.chat.id)
         keyword = message.text.strip()
-        logger.info(f"Поиск по ключевому слову: {keyword} от {message.chat.id}")
-        results = search_questions(keyword)
+        log_sampled(logger, "Поиск по ключевому слову: %s от %s", keyword, message.chat.id)
+        results = search_questions(keyword).questions
+        metrics.SEARCH_RESULTS.inc(result="hit" if results else "empty")
+        analytics.record("search", message.chat.id, mode="search", query=keyword, results=len(results))
         if results:
-            text = f"🔍 *Результаты поиска по '{escape_markdown(keyword)}':*\n\n"
-            markup = InlineKeyboardMarkup()
-            for i, result in enumerate(results, 1):
-                text += f"_{i}\\. {escape_markdown(result['question'])} ❓_\n"
-                markup.add(InlineKeyboardButton(f"❓ Вопрос {i}", callback_data=f"q_{result['id']}"))
-            markup.add(InlineKeyboardButton("⬅️ Назад", callback_data="back_to_categories"))
-            bot.reply_to(message, text, reply_markup=markup, parse_mode='MarkdownV2')
+            menu = render_search_results(f"🔍 *Результаты поиска по '{escape_markdown(keyword)}':*", results)
+            tg.reply_to(message, menu.text, reply_markup=menu.markup, parse_mode='MarkdownV2')
         else:
-            bot.reply_to(
+            reply_not_found(message, keyword)
+    except Exception as e:
+        metrics.HANDLER_ERRORS.inc(handler="process_search")
+        logger.error(f"Ошибка при поиске: {e}")
+        tg.reply_to(message, ERROR_TEXT, reply_markup=create_category_buttons(), parse_mode='MarkdownV2')
+
+# Обычное сообщение вне диалога: уверенно найденный вопрос - сразу ответ,
+# иначе - список подходящих вопросов
+@instrumented("process_free_text")
+def process_free_text(message):
+    try:
+        keyword = message.text.strip()
+        log_sampled(logger, "Свободный вопрос: %s от %s", keyword, message.chat.id)
+        outcome = search_questions(keyword)
+        # Вне диалога пишут что угодно (в том числе ФИО и телефон после истечения
+        # заявки), поэтому сохраняются только нормальные формы найденных запросов
+        fields = {"query": answerer.query_key(keyword)} if outcome.questions else {}
+        analytics.record("search", message.chat.id, mode="free_text",
+                         results=len(outcome.questions), confident=outcome.confident, **fields)
+        if outcome.confident:
+            analytics.record("question_view", message.chat.id, question_id=outcome.questions[0].id, source="free_text")
+            metrics.FREE_TEXT_ANSWERS.inc(result="answer")
+            snapshot = faq_runtime.current
+            tg.reply_to(
                 message,
-                escape_markdown(f"😕 Не могу знать, в моей базе знаний отсутствует информация по запросу *{keyword}*."),
-                reply_markup=create_category_buttons(),
+                snapshot.menus.answer_text(outcome.questions[0].id),
+                reply_markup=snapshot.menus.categories.markup,
                 parse_mode='MarkdownV2'
             )
+        elif outcome.questions:
+            metrics.FREE_TEXT_ANSWERS.inc(result="choices")
+            menu = render_search_results("🔍 *Возможно, вы имели в виду:*", outcome.questions)
+            tg.reply_to(message, menu.text, reply_markup=menu.markup, parse_mode='MarkdownV2')
+        else:
+            metrics.FREE_TEXT_ANSWERS.inc(result="empty")
+            reply_not_found(message, keyword)
     except Exception as e:
-        logger.error(f"Ошибка при поиске: {e}")
-        bot.reply_to(message, escape_markdown("❌ Произошла ошибка."), reply_markup=create_category_buttons(), parse_mode='MarkdownV2')
+        metrics.HANDLER_ERRORS.inc(handler="process_free_text")
+        logger.error(f"Ошибка при обработке вопроса: {e}")
+        tg.reply_to(message, ERROR_TEXT, reply_markup=create_category_buttons(), parse_mode='MarkdownV2')
 
 # Обработка заявок
 def start_application(call):
@@ -195,79 +270,83 @@ def start_application(call):
         username = call.from_user.username
         logger.info(f"Начало заявки для chat_id: {chat_id}, username: {username}")
         if not username:
-            bot.send_message(
+            tg.send_message(
                 chat_id,
                 escape_markdown("⚠️ У вас не указан username в Telegram (например, @mishanosikov). Пожалуйста, установите его в настройках Telegram и попробуйте снова, или укажите username вручную:"),
                 parse_mode='MarkdownV2'
             )
-            bot.register_next_step_handler(call.message, process_manual_username, chat_id)
+            state_store.set(chat_id, {"step": "username", "chatId": chat_id})
             return
-        user_data_storage[chat_id] = {"telegramId": f"@{username}", "chatId": chat_id}
-        logger.info(f"Заявка инициализирована: {user_data_storage[chat_id]}")
-        bot.send_message(
+        state = {"step": "fio", "telegramId": f"@{username}", "chatId": chat_id}
+        state_store.set(chat_id, state)
+        logger.info(f"Заявка инициализирована: {state}")
+        tg.send_message(
             chat_id,
             escape_markdown("📝 Введи ФИО (например, Носиков Михаил Валерьевич):"),
             parse_mode='MarkdownV2'
         )
-        bot.register_next_step_handler(call.message, process_name, chat_id)
     except Exception as e:
         logger.error(f"Ошибка при оформлении заявки для {chat_id}: {e}")
-        bot.send_message(chat_id, escape_markdown("❌ Произошла ошибка."), reply_markup=create_category_buttons(), parse_mode='MarkdownV2')
+        tg.send_message(chat_id, ERROR_TEXT, reply_markup=create_category_buttons(), parse_mode='MarkdownV2')
 
-def process_manual_username(message, chat_id):
+def process_manual_username(message, state):
+    chat_id = state["chatId"]
     try:
         username = message.text.strip()
         if not username.startswith('@'):
             username = f"@{username}"
-        user_data_storage[chat_id] = {"telegramId": username, "chatId": chat_id}
+        state_store.set(chat_id, {"step": "fio", "telegramId": username, "chatId": chat_id})
         logger.info(f"Ручной username: {username} для {chat_id}")
-        bot.reply_to(
+        tg.reply_to(
             message,
             escape_markdown("📝 Введи ФИО (например, Носиков Михаил Валерьевич):"),
             parse_mode='MarkdownV2'
         )
-        bot.register_next_step_handler(message, process_name, chat_id)
     except Exception as e:
         logger.error(f"Ошибка при обработке ручного username для {chat_id}: {e}")
-        bot.reply_to(message, escape_markdown("❌ Произошла ошибка."), reply_markup=create_category_buttons(), parse_mode='MarkdownV2')
+        tg.reply_to(message, ERROR_TEXT, reply_markup=create_category_buttons(), parse_mode='MarkdownV2')
 
-def process_name(message, chat_id):
+def process_name(message, state):
+    chat_id = state["chatId"]
     try:
-        user_data_storage[chat_id]["fio"] = message.text.strip()
-        logger.info(f"ФИО: {user_data_storage[chat_id]['fio']} для {chat_id}")
-        bot.reply_to(
+        state["fio"] = message.text.strip()
+        state["step"] = "phone"
+        state_store.set(chat_id, state)
+        logger.info(f"ФИО: {state['fio']} для {chat_id}")
+        tg.reply_to(
             message,
             escape_markdown("📞 Введи номер телефона (например, +79511222890):"),
             parse_mode='MarkdownV2'
         )
-        bot.register_next_step_handler(message, process_phone, chat_id)
     except Exception as e:
         logger.error(f"Ошибка при обработке ФИО для {chat_id}: {e}")
-        bot.reply_to(message, escape_markdown("❌ Произошла ошибка."), reply_markup=create_category_buttons(), parse_mode='MarkdownV2')
+        tg.reply_to(message, ERROR_TEXT, reply_markup=create_category_buttons(), parse_mode='MarkdownV2')
 
-def process_phone(message, chat_id):
+def process_phone(message, state):
+    chat_id = state["chatId"]
     try:
         phone = message.text.strip()
         # Валидация номера телефона
         phone = re.sub(r'\D', '', phone)  # Удаляем нецифровые символы
         if not phone.startswith('7') and not phone.startswith('8'):
-            bot.reply_to(
+            tg.reply_to(
                 message,
                 escape_markdown("❌ Номер телефона должен начинаться с +7, 7 или 8. Попробуй снова:"),
                 parse_mode='MarkdownV2'
             )
-            bot.register_next_step_handler(message, process_phone, chat_id)
             return
         if phone.startswith('8'):
             phone = '7' + phone[1:]
         if not phone.startswith('+'):
             phone = '+' + phone
-        user_data_storage[chat_id]["phone"] = phone
-        logger.info(f"Телефон: {user_data_storage[chat_id]['phone']} для {chat_id}")
+        state["phone"] = phone
+        state["step"] = "program"
+        state_store.set(chat_id, state)
+        logger.info(f"Телефон: {state['phone']} для {chat_id}")
         markup = InlineKeyboardMarkup()
-        markup.add(InlineKeyboardButton("🎓 Высшее образование", callback_data=f"prog_vo_{chat_id}"))
-        markup.add(InlineKeyboardButton("🛠️ Среднее профессиональное", callback_data=f"prog_spo_{chat_id}"))
-        bot.reply_to(
+        markup.add(InlineKeyboardButton("🎓 Высшее образование", callback_data=encode_callback("program", "vo")))
+        markup.add(InlineKeyboardButton("🛠️ Среднее профессиональное", callback_data=encode_callback("program", "spo")))
+        tg.reply_to(
             message,
             escape_markdown("🎓 Выбери программу обучения:"),
             reply_markup=markup,
@@ -275,165 +354,263 @@ def process_phone(message, chat_id):
         )
     except Exception as e:
         logger.error(f"Ошибка при обработке телефона для {chat_id}: {e}")
-        bot.reply_to(message, escape_markdown("❌ Произошла ошибка."), reply_markup=create_category_buttons(), parse_mode='MarkdownV2')
+        tg.reply_to(message, ERROR_TEXT, reply_markup=create_category_buttons(), parse_mode='MarkdownV2')
+
+# Шаги диалогов, ожидающие текстового ответа
+STEP_HANDLERS = {
+    "search": process_search,
+    "username": process_manual_username,
+    "fio": process_name,
+    "phone": process_phone,
+}
+
+# Ответ на текущий шаг диалога (вместо register_next_step_handler,
+# чтобы состояние не зависело от процесса, принявшего сообщение).
+# Вне диалога текст считается вопросом к FAQ; неизвестные команды игнорируются.
+@bot.message_handler(content_types=['text'])
+def process_step(message):
+    state = state_store.get(message.chat.id)
+    handler = STEP_HANDLERS.get(state["step"]) if state else None
+    if handler is not None:
+        handler(message, state)
+    elif not message.text.startswith('/'):
+        process_free_text(message)
+
+# Обработчики кнопок: callback, меню текущего снимка FAQ, аргументы из callback_data
+def edit_menu(call, menu):
+    tg.answer_callback_query(call.id)
+    tg.edit_message_text(
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        text=menu.text,
+        reply_markup=menu.markup,
+        parse_mode='MarkdownV2'
+    )
+
+# Тестовые кнопки
+TEST_ANSWERS = {"q1_yes": "Да ✅", "q1_no": "Нет ❌", "q2_good": "Хорошо 👍", "q2_bad": "Плохо 👎"}
+
+def on_test(call, menus, answer):
+    if answer not in TEST_ANSWERS:
+        tg.answer_callback_query(call.id)
+        return
+    tg.answer_callback_query(call.id, f"Вы выбрали: {TEST_ANSWERS[answer]}")
+    tg.send_message(
+        call.message.chat.id,
+        escape_markdown(f"✅ Спасибо за ответ: {TEST_ANSWERS[answer]}"),
+        parse_mode='MarkdownV2'
+    )
+
+# Список категорий
+def on_categories(call, menus):
+    edit_menu(call, menus.categories)
+
+# Подкатегории категории
+def on_category(call, menus, cat_index):
+    menu = menus.subcategory_menu(cat_index)
+    if menu is None:
+        logger.error(f"Неверный индекс категории: {cat_index}")
+        tg.answer_callback_query(call.id, "❌ Категория не найдена.")
+        return
+    analytics.record("category_open", call.message.chat.id, category=cat_index)
+    edit_menu(call, menu)
+
+# Страница вопросов подкатегории
+def on_subcategory(call, menus, cat_index, subcat_index, page):
+    menu = menus.questions_menu(cat_index, subcat_index, page)
+    if menu is None:
+        logger.error(f"Неверный индекс: cat_index={cat_index}, subcat_index={subcat_index}, page={page}")
+        tg.answer_callback_query(call.id, "❌ Категория не найдена.")
+        return
+    edit_menu(call, menu)
+
+# Ответ на вопрос
+def on_question(call, menus, question_id):
+    answer_text = menus.answer_text(question_id)
+    if answer_text is None:
+        logger.error(f"Вопрос не найден: {question_id}")
+        tg.answer_callback_query(call.id, "❌ Вопрос не найден.")
+        return
+    analytics.record("question_view", call.message.chat.id, question_id=question_id)
+    tg.answer_callback_query(call.id)
+    tg.send_message(
+        call.message.chat.id,
+        answer_text,
+        reply_markup=menus.categories.markup,
+        parse_mode='MarkdownV2'
+    )
+
+# Заявка
+def on_apply(call, menus):
+    analytics.record("application_start", call.message.chat.id)
+    tg.answer_callback_query(call.id)
+    tg.send_message(
+        call.message.chat.id,
+        escape_markdown("📝 Начнем оформление заявки:"),
+        parse_mode='MarkdownV2'
+    )
+    start_application(call)
+
+# Программа обучения: последний шаг заявки
+PROGRAMS = {"vo": "Высшее образование", "spo": "Среднее профессиональное"}
+
+def on_program(call, menus, program_code):
+    chat_id = str(call.message.chat.id)
+    user_data = state_store.get(chat_id)
+    if program_code in PROGRAMS and user_data and "phone" in user_data:
+        user_data.pop("step", None)
+        user_data["program"] = PROGRAMS[program_code]
+        analytics.record("application_submit", chat_id, program=program_code)
+        logger.info(f"Отправка заявки: {user_data}")
+        tg.answer_callback_query(call.id)
+        tg.send_message(
+            chat_id,
+            escape_markdown("✅ Заявка отправлена! Мы свяжемся с вами. 📞"),
+            reply_markup=menus.categories.markup,
+            parse_mode='MarkdownV2'
+        )
+        # Отправка в Apps Script в фоне
+        submitter.submit(user_data)
+        state_store.delete(chat_id)
+    else:
+        logger.error(f"Данные заявки не найдены для {chat_id}")
+        tg.answer_callback_query(call.id)
+        tg.send_message(
+            chat_id,
+            escape_markdown("❌ Ошибка: данные заявки потеряны. Попробуй снова."),
+            reply_markup=menus.categories.markup,
+            parse_mode='MarkdownV2'
+        )
+
+# Поиск
+def on_search(call, menus):
+    tg.answer_callback_query(call.id)
+    tg.send_message(
+        call.message.chat.id,
+        SEARCH_PROMPT_TEXT,
+        parse_mode='MarkdownV2'
+    )
+    state_store.set(call.message.chat.id, {"step": "search"})
+
+# Действие кнопки -> обработчик (действия и формат callback_data - в callbacks.py)
+CALLBACK_HANDLERS = {
+    "test": on_test,
+    "categories": on_categories,
+    "category": on_category,
+    "subcategory": on_subcategory,
+    "question": on_question,
+    "apply": on_apply,
+    "program": on_program,
+    "search": on_search,
+}
 
 # Обработка callback-запросов
 @bot.callback_query_handler(func=lambda call: True)
+@instrumented("callback_query")
 def callback_query(call):
     try:
-        logger.info(f"Получен callback: {call.data} от {call.message.chat.id}")
-        data = call.data
-
-        # Тестовые кнопки
-        if data in ["q1_yes", "q1_no", "q2_good", "q2_bad"]:
-            answers = {"q1_yes": "Да ✅", "q1_no": "Нет ❌", "q2_good": "Хорошо 👍", "q2_bad": "Плохо 👎"}
-            bot.answer_callback_query(call.id, f"Вы выбрали: {answers[data]}")
-            bot.send_message(
-                call.message.chat.id,
-                escape_markdown(f"✅ Спасибо за ответ: {answers[data]}"),
-                parse_mode='MarkdownV2'
-            )
-            return
-
-        # Категории
-        if data.startswith("cat_"):
-            cat_index = int(data[4:])
-            bot.answer_callback_query(call.id)
-            category_name = faq_data['categories'][cat_index]['name']
-            bot.edit_message_text(
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                text=escape_markdown(f"✨ Выбери подкатегорию в '{category_name}':"),
-                reply_markup=create_subcategory_buttons(cat_index),
-                parse_mode='MarkdownV2'
-            )
-            return
-
-        # Подкатегории
-        if data.startswith("subcat_"):
-            cat_index, subcat_index = map(int, data[7:].split("_"))
-            bot.answer_callback_query(call.id)
-            bot.edit_message_text(
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                text=get_questions_text(cat_index, subcat_index),
-                reply_markup=create_question_buttons(cat_index, subcat_index),
-                parse_mode='MarkdownV2'
-            )
-            return
-
-        # Вопросы
-        if data.startswith("q_"):
-            question_id = int(data[2:])
-            for category in faq_data['categories']:
-                for subcategory in category['subcategories']:
-                    for question in subcategory['questions']:
-                        if question['id'] == question_id:
-                            bot.answer_callback_query(call.id)
-                            bot.send_message(
-                                call.message.chat.id,
-                                escape_markdown(f"❓ Вопрос: {question['question']}\n\n✅ Ответ: {question['answer']}"),
-                                reply_markup=create_category_buttons(),
-                                parse_mode='MarkdownV2'
-                            )
-                            return
-
-        # Заявка
-        if data == "apply":
-            bot.answer_callback_query(call.id)
-            bot.send_message(
-                call.message.chat.id,
-                escape_markdown("📝 Начнем оформление заявки:"),
-                parse_mode='MarkdownV2'
-            )
-            start_application(call)
+        log_sampled(logger, "Получен callback: %s от %s", call.data, call.message.chat.id)
+        decoded = decode_callback(call.data)
+        if decoded is None:
+            logger.warning(f"Неизвестная кнопка: {call.data}")
+            tg.answer_callback_query(call.id, "⚠️ Кнопка устарела, открой меню заново: /start")
             return
-
-        # Программа обучения
-        if data.startswith("prog_"):
-            parts = data.split("_")
-            program = "Высшее образование" if parts[1] == "vo" else "Среднее профессиональное"
-            chat_id = parts[2]
-            if chat_id in user_data_storage:
-                user_data = user_data_storage[chat_id]
-                user_data["program"] = program
-                logger.info(f"Отправка заявки: {user_data}")
-                bot.answer_callback_query(call.id)
-                bot.send_message(
-                    call.message.chat.id,
-                    escape_markdown("✅ Заявка отправлена! Мы свяжемся с вами. 📞"),
-                    reply_markup=create_category_buttons(),
-                    parse_mode='MarkdownV2'
-                )
-                # Отправка в Apps Script
-                response = requests.post(APPS_SCRIPT_URL, json=user_data)
-                if response.json().get('status') == 'success':
-                    logger.info(f"Заявка сохранена: {user_data}")
-                else:
-                    logger.error(f"Ошибка сохранения заявки: {response.json()}")
-                del user_data_storage[chat_id]
-            else:
-                logger.error(f"Данные заявки не найдены для {chat_id}")
-                bot.send_message(
-                    call.message.chat.id,
-                    escape_markdown("❌ Ошибка: данные заявки потеряны. Попробуй снова."),
-                    reply_markup=create_category_buttons(),
-                    parse_mode='MarkdownV2'
-                )
-            return
-
-        # Возврат
-        if data == "back_to_categories":
-            bot.answer_callback_query(call.id)
-            bot.edit_message_text(
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                text=escape_markdown("📚 Выбери категорию:"),
-                reply_markup=create_category_buttons(),
-                parse_mode='MarkdownV2'
-            )
-            return
-
-        if data.startswith("back_to_subcat_"):
-            cat_index = int(data[15:])
-            category_name = faq_data['categories'][cat_index]['name']
-            bot.edit_message_text(
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                text=escape_markdown(f"✨ Выбери подкатегорию в '{category_name}':"),
-                reply_markup=create_subcategory_buttons(cat_index),
-                parse_mode='MarkdownV2'
-            )
-            return
-
-        # Поиск
-        if data == "search":
-            bot.answer_callback_query(call.id)
-            bot.send_message(
-                call.message.chat.id,
-                escape_markdown("🔍 Введи ключевое слово для поиска:"),
-                parse_mode='MarkdownV2'
-            )
-            bot.register_next_step_handler(call.message, process_search)
-            return
-
+        action, args = decoded
+        CALLBACK_HANDLERS[action](call, faq_runtime.current.menus, *args)
     except Exception as e:
+        metrics.HANDLER_ERRORS.inc(handler="callback_query")
         logger.error(f"Ошибка при обработке callback: {e}")
-        bot.answer_callback_query(call.id, escape_markdown("❌ Произошла ошибка."))
+        tg.answer_callback_query(call.id, ERROR_TEXT)
+
+def update_labels(update):
+    if update.message is not None:
+        return "message", "command" if (update.message.text or "").startswith('/') else "text"
+    if update.callback_query is not None:
+        decoded = decode_callback(update.callback_query.data)
+        return "callback_query", decoded[0] if decoded else "other"
+    return "other", ""
+
+# Обработка одного обновления (JSON-строка или словарь)
+def process_update(update_json):
+    started = time.perf_counter()
+    update = telebot.types.Update.de_json(update_json)
+    if update:
+        bot.process_new_updates([update])
+        update_type, prefix = update_labels(update)
+        metrics.UPDATE_SECONDS.observe(time.perf_counter() - started, type=update_type, prefix=prefix)
+    if "first_response_seconds" not in startup_timings:
+        finished = time.perf_counter()
+        startup_timings["first_response_seconds"] = round(finished - started, 3)
+        startup_timings["first_response_since_import"] = round(finished - IMPORT_STARTED, 3)
+        logger.info(f"Первое обновление обработано: {startup_timings}")
+
+# Обработка в пуле (async-вебхук, long polling): здесь вызовы Bot API
+# могут ждать лимиты, не задерживая ответ на вебхук
+def process_update_paced(update_json):
+    with tg.pacing():
+        process_update(update_json)
+
+# Режим вебхука: sync - обработка внутри запроса, async - через пул обработчиков
+WEBHOOK_MODE = os.getenv("WEBHOOK_MODE", "sync")
+dispatcher = UpdateDispatcher(
+    process_update_paced,
+    workers=int(os.getenv("WEBHOOK_WORKERS", "4")),
+    queue_size=int(os.getenv("WEBHOOK_QUEUE_SIZE", "100")),
+)
+if WEBHOOK_MODE == "async":
+    dispatcher.start()
+    atexit.register(dispatcher.stop)
 
 # Маршрут для вебхуков
 @app.route(f"/{TOKEN}", methods=['POST'])
 def get_message():
+    started = time.perf_counter()
+    status = 500
     try:
-        logger.info("Получен POST-запрос от Telegram")
+        log_sampled(logger, "Получен POST-запрос от Telegram")
         json_string = request.get_data().decode("utf-8")
-        update = telebot.types.Update.de_json(json_string)
-        if update:
-            bot.process_new_updates([update])
+        if WEBHOOK_MODE == "async":
+            # Подтверждаем сразу; при переполнении очереди Telegram повторит доставку
+            status = 200 if dispatcher.submit(json.loads(json_string)) else 503
+            return "!", status
+        process_update(json_string)
+        status = 200
         return "!", 200
     except Exception as e:
         logger.error(f"Ошибка при обработке вебхука: {e}")
         return "!", 500
+    finally:
+        metrics.WEBHOOK_REQUESTS.inc(mode=WEBHOOK_MODE, status=status)
+        metrics.WEBHOOK_SECONDS.observe(time.perf_counter() - started, mode=WEBHOOK_MODE)
+
+# Показатели, считываемые при выгрузке метрик
+metrics.CallbackGauge("bot_update_queue_depth", "Обновления в очереди пула обработчиков", lambda: dispatcher.stats()["depth"])
+metrics.CallbackCounter("bot_update_queue_rejected_total", "Обновления, отклоненные из-за переполнения очереди", lambda: dispatcher.stats()["rejected"])
+metrics.CallbackCounter("bot_lemma_cache_hits_total", "Попадания в кэш нормальных форм", lambda: cache_stats()["hits"])
+metrics.CallbackCounter("bot_lemma_cache_misses_total", "Промахи кэша нормальных форм", lambda: cache_stats()["misses"])
+metrics.CallbackCounter("bot_search_cache_hits_total", "Попадания в кэш поисковых запросов", lambda: answerer.stats()["hits"])
+metrics.CallbackCounter("bot_search_cache_misses_total", "Промахи кэша поисковых запросов", lambda: answerer.stats()["misses"])
+metrics.CallbackCounter("bot_analytics_dropped_total", "События аналитики, вытесненные из переполненного буфера", lambda: analytics.stats()["dropped"])
+metrics.CallbackGauge("bot_telegram_deferred_pending", "Отложенные вызовы Bot API, ожидающие выполнения", tg.deferred_count)
+metrics.CallbackGauge("bot_application_queue_depth", "Заявки, ожидающие отправки в Apps Script", submitter.pending_count)
+
+# Метрики в формате Prometheus
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+# Статистика кэшей и пула обработчиков
+@app.route("/stats")
+def stats():
+    return {"lemma_cache": cache_stats(), "search_cache": answerer.stats(), "analytics": analytics.stats(), "dispatcher": dispatcher.stats(), "startup": startup_timings}, 200
+
+# Перезагрузка FAQ по запросу администратора (остальные воркеры подхватят
+# ее через watcher в течение FAQ_WATCH_INTERVAL)
+@app.route(f"/{TOKEN}/reload", methods=['POST'])
+def reload_faq():
+    if not faq_runtime.request_reload():
+        return "Reload started in this worker only: faq.json is not writable, other workers will not reload", 202
+    return "Reload started", 202
 
 # Главная страница
 @app.route("/")
@@ -446,5 +623,8 @@ def webhook():
         logger.error(f"Ошибка при установке вебхука: {e}")
         return "Webhook error", 500
 
+startup_timings["import_seconds"] = round(time.perf_counter() - IMPORT_STARTED, 3)
+logger.info(f"Модуль бота загружен за {startup_timings['import_seconds']} с")
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 5000)))
@@ -0,0 +1,101 @@
+import re
+
+# Версия формата callback_data; кнопки другой версии считаются устаревшими
+CALLBACK_VERSION = "1"
+
+# Ограничение Telegram на callback_data, байты
+MAX_CALLBACK_BYTES = 64
+
+# Действия кнопок: код в callback_data и типы аргументов
+ACTIONS = {
+    "categories": ("c", ()),
+    "category": ("k", (int,)),
+    "subcategory": ("s", (int, int, int)),
+    "question": ("q", (int,)),
+    "apply": ("a", ()),
+    "program": ("p", (str,)),
+    "search": ("f", ()),
+    "test": ("t", (str,)),
+}
+_BY_CODE = {code: (action, types) for action, (code, types) in ACTIONS.items()}
+
+_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+_TOKEN_RE = re.compile(r'[0-9a-z_]+')
+
+
+def _to_base36(value):
+    if value < 0:
+        raise ValueError(f"Отрицательное число в callback_data: {value}")
+    digits = ""
+    while True:
+        value, remainder = divmod(value, 36)
+        digits = _DIGITS[remainder] + digits
+        if not value:
+            return digits
+
+
+# Кодирование кнопки: версия и код действия, затем аргументы через точку
+# (числа - в base36): "1k.3" - категория 3, "1s.0.1.2" - третья страница
+# подкатегории 1 категории 0
+def encode(action, *args):
+    code, types = ACTIONS[action]
+    if len(args) != len(types):
+        raise ValueError(f"Действию {action} нужно аргументов: {len(types)}")
+    parts = [CALLBACK_VERSION + code]
+    for value, kind in zip(args, types):
+        if kind is int:
+            parts.append(_to_base36(int(value)))
+        elif _TOKEN_RE.fullmatch(str(value)):
+            parts.append(str(value))
+        else:
+            raise ValueError(f"Недопустимый аргумент callback_data: {value!r}")
+    data = ".".join(parts)
+    if len(data.encode('utf-8')) > MAX_CALLBACK_BYTES:
+        raise ValueError(f"callback_data длиннее {MAX_CALLBACK_BYTES} байт: {data}")
+    return data
+
+
+# Разбор callback_data: (действие, аргументы) или None для неизвестных
+# и устаревших кнопок. Кнопки в старом формате (cat_1, subcat_0_1, q_12, ...)
+# из уже отправленных сообщений продолжают работать.
+def decode(data):
+    if not data:
+        return None
+    if not data[0].isdigit():
+        return _decode_legacy(data)
+    if not data.startswith(CALLBACK_VERSION):
+        return None
+    parts = data[len(CALLBACK_VERSION):].split(".")
+    entry = _BY_CODE.get(parts[0])
+    if entry is None:
+        return None
+    action, types = entry
+    if len(parts) - 1 != len(types):
+        return None
+    try:
+        args = tuple(int(value, 36) if kind is int else value for value, kind in zip(parts[1:], types))
+    except ValueError:
+        return None
+    return action, args
+
+
+_LEGACY_TEST = ("q1_yes", "q1_no", "q2_good", "q2_bad")
+_LEGACY_RE = (
+    (re.compile(r'back_to_categories'), lambda: ("categories", ())),
+    (re.compile(r'(?:back_to_subcat|cat)_(\d+)'), lambda c: ("category", (int(c),))),
+    (re.compile(r'subcat_(\d+)_(\d+)'), lambda c, s: ("subcategory", (int(c), int(s), 0))),
+    (re.compile(r'q_(\d+)'), lambda q: ("question", (int(q),))),
+    (re.compile(r'apply'), lambda: ("apply", ())),
+    (re.compile(r'prog_(vo|spo)_-?\d+'), lambda program: ("program", (program,))),
+    (re.compile(r'search'), lambda: ("search", ())),
+)
+
+
+def _decode_legacy(data):
+    if data in _LEGACY_TEST:
+        return "test", (data,)
+    for pattern, build in _LEGACY_RE:
+        match = pattern.fullmatch(data)
+        if match:
+            return build(*match.groups())
+    return None
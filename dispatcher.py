@@ -0,0 +1,110 @@
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Типы обновлений, в которых чат лежит прямо в объекте
+CHAT_UPDATE_TYPES = ('message', 'edited_message', 'channel_post', 'edited_channel_post')
+
+
+# Ключ упорядочивания: id чата, а если его нет - id пользователя или update_id
+def chat_key(update):
+    for update_type in CHAT_UPDATE_TYPES:
+        if update_type in update:
+            return update[update_type]['chat']['id']
+    callback_query = update.get('callback_query')
+    if callback_query:
+        message = callback_query.get('message')
+        if message:
+            return message['chat']['id']
+        return callback_query['from']['id']
+    for value in update.values():
+        if isinstance(value, dict) and isinstance(value.get('from'), dict):
+            return value['from']['id']
+    return update.get('update_id', 0)
+
+
+# Пул обработчиков обновлений Telegram.
+# Каждому рабочему потоку соответствует своя ограниченная очередь; обновления
+# одного чата всегда попадают в одну и ту же очередь, поэтому обрабатываются
+# по порядку (это важно для шагов диалога в хранилище состояний). При заполнении
+# очереди submit ждет enqueue_timeout и возвращает False.
+class UpdateDispatcher:
+    def __init__(self, process, workers=4, queue_size=100, enqueue_timeout=1.0, name="update-worker"):
+        self.process = process
+        self.enqueue_timeout = enqueue_timeout
+        self.name = name
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(max(1, workers))]
+        self._threads = []
+        self._stats_lock = threading.Lock()
+        self._stats = {"enqueued": 0, "processed": 0, "failed": 0, "rejected": 0, "max_depth": 0}
+        self._started = False
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        with self._start_lock:
+            if self._started:
+                return
+            for i, shard in enumerate(self._queues):
+                thread = threading.Thread(target=self._run, args=(shard,), name=f"{self.name}-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._started = True
+
+    # Остановка: дожидаемся обработки уже принятых обновлений
+    def stop(self, timeout=10):
+        for shard in self._queues:
+            try:
+                shard.put(None, timeout=timeout)
+            except queue.Full:
+                logger.error(f"Очередь {self.name} не освободилась при остановке")
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+
+    def submit(self, update):
+        self.start()
+        shard = self._queues[hash(chat_key(update)) % len(self._queues)]
+        try:
+            shard.put((time.monotonic(), update), timeout=self.enqueue_timeout)
+        except queue.Full:
+            self._count("rejected")
+            logger.warning(f"Очередь обновлений переполнена, update_id={update.get('update_id')}")
+            return False
+        depth = shard.qsize()
+        with self._stats_lock:
+            self._stats["enqueued"] += 1
+            if depth > self._stats["max_depth"]:
+                self._stats["max_depth"] = depth
+        return True
+
+    # Счетчики и текущая глубина очередей
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["depth"] = sum(shard.qsize() for shard in self._queues)
+        stats["capacity"] = sum(shard.maxsize for shard in self._queues)
+        stats["workers"] = len(self._queues)
+        return stats
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def _run(self, shard):
+        while True:
+            item = shard.get()
+            if item is None:
+                return
+            enqueued_at, update = item
+            wait = time.monotonic() - enqueued_at
+            if wait > 5:
+                logger.warning(f"Обновление {update.get('update_id')} ждало в очереди {wait:.1f} с")
+            try:
+                self.process(update)
+                self._count("processed")
+            except Exception as e:
+                self._count("failed")
+                logger.error(f"Ошибка при обработке обновления {update.get('update_id')}: {e}")
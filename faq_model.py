@@ -0,0 +1,129 @@
+import hashlib
+import json
+
+
+# Скомпилированная модель FAQ: неизменяемые записи со ссылками на родителей
+# и словарь id -> вопрос. Строится один раз из faq.json.
+class Question:
+    __slots__ = ('id', 'question', 'answer', 'index', 'subcategory')
+
+    def __init__(self, question_id, question, answer, index, subcategory):
+        self.id = question_id
+        self.question = question
+        self.answer = answer
+        self.index = index
+        self.subcategory = subcategory
+
+    @property
+    def category(self):
+        return self.subcategory.category
+
+    def __repr__(self):
+        return f"Question({self.id}, {self.question!r})"
+
+
+class Subcategory:
+    __slots__ = ('name', 'index', 'category', 'questions', 'signature')
+
+    def __init__(self, name, index, category, signature=None):
+        self.name = name
+        self.index = index
+        self.category = category
+        self.questions = ()
+        # Хэш содержимого: по нему при перезагрузке находятся неизмененные подкатегории
+        self.signature = signature
+
+    def __repr__(self):
+        return f"Subcategory({self.category.index}, {self.index}, {self.name!r})"
+
+
+class Category:
+    __slots__ = ('name', 'index', 'subcategories')
+
+    def __init__(self, name, index):
+        self.name = name
+        self.index = index
+        self.subcategories = ()
+
+    def __repr__(self):
+        return f"Category({self.index}, {self.name!r})"
+
+
+class FaqModel:
+    __slots__ = ('categories', 'questions_by_id')
+
+    def __init__(self, categories):
+        self.categories = tuple(categories)
+        self.questions_by_id = {}
+        for category in self.categories:
+            for subcategory in category.subcategories:
+                for question in subcategory.questions:
+                    if question.id in self.questions_by_id:
+                        raise ValueError(f"Повторяющийся id вопроса: {question.id}")
+                    self.questions_by_id[question.id] = question
+
+    # Доступ по индексам и id: при отсутствии возвращается None
+    def category(self, cat_index):
+        if 0 <= cat_index < len(self.categories):
+            return self.categories[cat_index]
+        return None
+
+    def subcategory(self, cat_index, subcat_index):
+        category = self.category(cat_index)
+        if category is not None and 0 <= subcat_index < len(category.subcategories):
+            return category.subcategories[subcat_index]
+        return None
+
+    def question(self, question_id):
+        return self.questions_by_id.get(question_id)
+
+    def iter_subcategories(self):
+        for category in self.categories:
+            yield from category.subcategories
+
+    def iter_questions(self):
+        for subcategory in self.iter_subcategories():
+            yield from subcategory.questions
+
+
+def _signature(raw_subcategory):
+    payload = json.dumps(raw_subcategory, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+# Проверка структуры faq.json до построения модели
+def validate_faq_data(faq_data):
+    if not isinstance(faq_data, dict) or not isinstance(faq_data.get('categories'), list):
+        raise ValueError("В faq.json нет списка 'categories'")
+    for raw_category in faq_data['categories']:
+        if not raw_category.get('name') or not isinstance(raw_category.get('subcategories'), list):
+            raise ValueError(f"Некорректная категория: {raw_category.get('name')!r}")
+        for raw_subcategory in raw_category['subcategories']:
+            if not raw_subcategory.get('name') or not isinstance(raw_subcategory.get('questions'), list):
+                raise ValueError(f"Некорректная подкатегория: {raw_subcategory.get('name')!r}")
+            for raw in raw_subcategory['questions']:
+                if not isinstance(raw.get('id'), int) or not raw.get('question') or not raw.get('answer'):
+                    raise ValueError(f"Некорректный вопрос в '{raw_subcategory['name']}': {raw.get('id')!r}")
+
+
+def build_faq_model(faq_data):
+    validate_faq_data(faq_data)
+    categories = []
+    for cat_index, raw_category in enumerate(faq_data['categories']):
+        category = Category(raw_category['name'], cat_index)
+        subcategories = []
+        for subcat_index, raw_subcategory in enumerate(raw_category['subcategories']):
+            subcategory = Subcategory(raw_subcategory['name'], subcat_index, category, _signature(raw_subcategory))
+            subcategory.questions = tuple(
+                Question(int(raw['id']), raw['question'], raw['answer'], index, subcategory)
+                for index, raw in enumerate(raw_subcategory['questions'])
+            )
+            subcategories.append(subcategory)
+        category.subcategories = tuple(subcategories)
+        categories.append(category)
+    return FaqModel(categories)
+
+
+def load_faq_model(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return build_faq_model(json.load(f))
@@ -0,0 +1,183 @@
+import json
+import logging
+import os
+import threading
+import time
+from faq_model import build_faq_model
+from faq_snapshot import load_snapshot
+from search_index import SearchIndex
+from menus import Menus
+import lemmatizer
+
+logger = logging.getLogger(__name__)
+
+
+# Согласованный набор: модель FAQ и все производные от нее структуры.
+# Обработчики берут снимок один раз и работают только с ним.
+# Поисковый индекс строится при первом обращении (или при прогреве),
+# чтобы /start и меню не ждали загрузки pymorphy3. Семантический индекс
+# (если задан каталог артефакта) так же открывается при первом обращении.
+class FaqSnapshot:
+    __slots__ = ('faq', 'menus', 'mtime', 'loaded_at', '_search_index', '_index_builder', '_index_lock',
+                 '_semantic_index', '_semantic_loader', '_semantic_loaded')
+
+    def __init__(self, faq, menus, mtime, index_builder, semantic_loader=None):
+        self.faq = faq
+        self.menus = menus
+        self.mtime = mtime
+        self.loaded_at = time.time()
+        self._search_index = None
+        self._index_builder = index_builder
+        self._index_lock = threading.Lock()
+        self._semantic_index = None
+        self._semantic_loader = semantic_loader
+        self._semantic_loaded = semantic_loader is None
+
+    @property
+    def search_index(self):
+        index = self._search_index
+        if index is None:
+            with self._index_lock:
+                if self._search_index is None:
+                    started = time.perf_counter()
+                    self._search_index = self._index_builder()
+                    logger.info(f"Поисковый индекс построен за {time.perf_counter() - started:.3f} с")
+                index = self._search_index
+        return index
+
+    def index_ready(self):
+        return self._search_index is not None
+
+    # None, если семантический поиск не настроен или артефакт не подходит к этому FAQ
+    @property
+    def semantic_index(self):
+        if not self._semantic_loaded:
+            with self._index_lock:
+                if not self._semantic_loaded:
+                    self._semantic_index = self._semantic_loader()
+                    self._semantic_loaded = True
+        return self._semantic_index
+
+
+# Текущий FAQ с перезагрузкой без перезапуска.
+# Новая версия файла читается и проверяется вне обработки запросов,
+# производные структуры пересобираются только для измененных подкатегорий,
+# после чего снимок подменяется одним присваиванием.
+class FaqRuntime:
+    def __init__(self, path, normalize, snapshot_path=None, semantic_dir=None, popularity=None):
+        self.path = path
+        self.normalize = normalize
+        self.snapshot_path = snapshot_path
+        self.semantic_dir = semantic_dir
+        # Просмотры вопросов из аналитики: порядок вопросов в меню
+        self.popularity = popularity
+        self.current = None
+        self._reload_lock = threading.Lock()
+        self._watcher = None
+        self._stop = threading.Event()
+        self._failed_mtime = None
+
+    # Первая загрузка: из предсобранного снимка, если он соответствует faq.json
+    def load(self):
+        with self._reload_lock:
+            snapshot = load_snapshot(self.path, self.snapshot_path) if self.snapshot_path else None
+            if snapshot is not None:
+                lemmatizer.preload(snapshot["lemmas"])
+                self.current = self._snapshot(snapshot["faq"], os.path.getmtime(self.path), snapshot["segments"], None)
+                logger.info(f"FAQ загружен из снимка {self.snapshot_path}")
+            else:
+                self.current = self._build(None)
+        return self.current
+
+    # Перезагрузка: True, если FAQ изменился и был подменен
+    def reload(self, force=False):
+        with self._reload_lock:
+            previous = self.current
+            mtime = os.path.getmtime(self.path)
+            if not force and previous is not None and mtime in (previous.mtime, self._failed_mtime):
+                return False
+            try:
+                snapshot = self._build(previous)
+                # Индекс строится здесь, до подмены, а не в первом запросе
+                snapshot.search_index
+            except Exception as e:
+                # Ошибочную версию не перечитываем, пока файл снова не изменится
+                self._failed_mtime = mtime
+                logger.error(f"Ошибка перезагрузки {self.path}, остается прежняя версия: {e}")
+                return False
+            self.current = snapshot
+        logger.info(
+            f"FAQ перезагружен: {len(snapshot.faq.questions_by_id)} вопросов, "
+            f"переиспользовано сегментов индекса: {snapshot.search_index.reused_segments}, "
+            f"меню подкатегорий: {snapshot.menus.reused_subcategories}"
+        )
+        return True
+
+    # Перезагрузка в фоновом потоке (для админского запроса)
+    def reload_async(self, force=True):
+        threading.Thread(target=self.reload, args=(force,), name="faq-reload", daemon=True).start()
+
+    # Перезагрузка во всех процессах: время модификации файла обновляется,
+    # и watcher каждого воркера gunicorn перечитывает FAQ; текущий процесс
+    # перезагружается сразу. False, если файл не удалось обновить
+    # (например, каталог только для чтения) - тогда остальные воркеры
+    # перезагрузку не увидят.
+    def request_reload(self):
+        try:
+            os.utime(self.path)
+            touched = True
+        except OSError as e:
+            logger.error(f"Не удалось обновить время модификации {self.path}: {e}")
+            touched = False
+        self.reload_async(force=True)
+        return touched
+
+    # Фоновый прогрев: pymorphy3 и поисковый индекс до первого поискового запроса
+    def start_warm_up(self):
+        threading.Thread(target=self._warm_up, name="faq-warm-up", daemon=True).start()
+
+    def _warm_up(self):
+        try:
+            self.current.search_index
+            lemmatizer.get_morph()
+        except Exception as e:
+            logger.error(f"Ошибка прогрева поиска: {e}")
+
+    # Слежение за изменением файла по времени модификации
+    def start_watcher(self, interval):
+        if self._watcher is not None or interval <= 0:
+            return
+        self._watcher = threading.Thread(target=self._watch, args=(interval,), name="faq-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop_watcher(self):
+        self._stop.set()
+
+    def _watch(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.reload()
+            except OSError as e:
+                logger.error(f"Ошибка проверки {self.path}: {e}")
+
+    def _build(self, previous):
+        mtime = os.path.getmtime(self.path)
+        with open(self.path, 'r', encoding='utf-8') as f:
+            faq = build_faq_model(json.load(f))
+        segments = None
+        if previous is not None and previous.index_ready():
+            segments = previous.search_index.segments
+        return self._snapshot(faq, mtime, segments, previous.menus if previous else None)
+
+    def _snapshot(self, faq, mtime, segments, previous_menus):
+        menus = Menus(faq, previous_menus, self.popularity)
+        semantic_loader = None
+        if self.semantic_dir:
+            semantic_loader = lambda: _load_semantic_index(faq, self.semantic_dir, self.normalize)
+        return FaqSnapshot(faq, menus, mtime, lambda: SearchIndex(faq, self.normalize, segments), semantic_loader)
+
+
+# numpy импортируется только при включенном семантическом поиске
+def _load_semantic_index(faq, semantic_dir, normalize):
+    from semantic_search import load_semantic_index
+    return load_semantic_index(faq, semantic_dir, normalize)
@@ -0,0 +1,63 @@
+import hashlib
+import json
+import logging
+import pickle
+import sys
+from faq_model import build_faq_model
+from search_index import SearchIndex, tokenize
+
+logger = logging.getLogger(__name__)
+
+# Версия формата снимка; при изменении структуры снимок просто пересобирается
+SNAPSHOT_VERSION = 2
+
+
+def _file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+# Сборка снимка: модель FAQ, сегменты поискового индекса и нормальные формы
+# всех слов FAQ. Загрузка снимка не требует ни разбора JSON, ни pymorphy3.
+def build_snapshot(faq_path, snapshot_path, normalize):
+    with open(faq_path, 'r', encoding='utf-8') as f:
+        faq = build_faq_model(json.load(f))
+    index = SearchIndex(faq, normalize)
+    lemmas = {}
+    for question in faq.iter_questions():
+        for word in tokenize(question.question) + tokenize(question.answer):
+            lemmas[word] = normalize(word)
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "source_hash": _file_hash(faq_path),
+        "faq": faq,
+        "segments": index.segments,
+        "lemmas": lemmas,
+    }
+    with open(snapshot_path, 'wb') as f:
+        pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return snapshot
+
+
+# Загрузка снимка; None, если его нет или он собран из другой версии faq.json
+def load_snapshot(faq_path, snapshot_path):
+    try:
+        with open(snapshot_path, 'rb') as f:
+            snapshot = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.error(f"Ошибка чтения снимка {snapshot_path}: {e}")
+        return None
+    if snapshot.get("version") != SNAPSHOT_VERSION or snapshot.get("source_hash") != _file_hash(faq_path):
+        logger.info(f"Снимок {snapshot_path} устарел, используется {faq_path}")
+        return None
+    return snapshot
+
+
+if __name__ == "__main__":
+    from lemmatizer import normal_form
+    faq_path = sys.argv[1] if len(sys.argv) > 1 else 'faq.json'
+    snapshot_path = sys.argv[2] if len(sys.argv) > 2 else 'faq.snapshot'
+    result = build_snapshot(faq_path, snapshot_path, normal_form)
+    print(f"Снимок {snapshot_path}: {len(result['faq'].questions_by_id)} вопросов, {len(result['lemmas'])} слов")
@@ -0,0 +1,67 @@
+import logging
+import os
+import threading
+import time
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Максимальное число слов в кэше нормальных форм (ограничивает память)
+LEMMA_CACHE_SIZE = int(os.getenv("LEMMA_CACHE_SIZE", "20000"))
+
+# Анализатор pymorphy3 создается при первом обращении (загрузка словарей заметна при старте)
+_morph = None
+_morph_lock = threading.Lock()
+
+# Заранее известные нормальные формы (например, словарь FAQ из снимка)
+_known = {}
+
+
+def get_morph():
+    global _morph
+    if _morph is None:
+        with _morph_lock:
+            if _morph is None:
+                started = time.perf_counter()
+                import pymorphy3
+                _morph = pymorphy3.MorphAnalyzer()
+                logger.info(f"pymorphy3 инициализирован за {time.perf_counter() - started:.3f} с")
+    return _morph
+
+
+def is_ready():
+    return _morph is not None
+
+
+@lru_cache(maxsize=LEMMA_CACHE_SIZE)
+def _cached_normal_form(word):
+    return get_morph().parse(word)[0].normal_form
+
+
+# Нормальная форма слова через LRU-кэш перед morph.parse
+def normal_form(word):
+    word = str(word).lower()
+    lemma = _known.get(word)
+    if lemma is not None:
+        return lemma
+    return _cached_normal_form(word)
+
+
+# Добавление готовых нормальных форм: слово -> лемма
+def preload(lemmas):
+    _known.update(lemmas)
+
+
+# Статистика попаданий в кэш
+def cache_stats():
+    info = _cached_normal_form.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        "hits": info.hits,
+        "misses": info.misses,
+        "size": info.currsize,
+        "maxsize": info.maxsize,
+        "hit_rate": round(info.hits / lookups, 4) if lookups else 0.0,
+        "preloaded": len(_known),
+        "analyzer_loaded": is_ready(),
+    }
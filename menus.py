@@ -0,0 +1,140 @@
+import re
+from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
+from callbacks import encode
+
+# Вопросов на одной странице подкатегории
+QUESTIONS_PER_PAGE = 5
+
+# Спецсимволы MarkdownV2
+MARKDOWN_SPECIAL_RE = re.compile(r'[_*[\]()~`>#+-=|{}.!]')
+
+
+# Экранирование специальных символов для MarkdownV2
+def escape_markdown(text):
+    return MARKDOWN_SPECIAL_RE.sub(r'\\\g<0>', str(text))
+
+
+# Готовое меню: текст в MarkdownV2 и клавиатура, уже сериализованная в JSON
+class RenderedMenu:
+    __slots__ = ('text', 'markup')
+
+    def __init__(self, text, markup):
+        self.text = text
+        self.markup = markup
+
+
+# Кнопки по одной в ряд; список кнопок вместо кнопки - один ряд из нескольких
+def _serialize(buttons):
+    markup = InlineKeyboardMarkup()
+    for button in buttons:
+        row = button if isinstance(button, list) else [button]
+        markup.row(*(InlineKeyboardButton(text, callback_data=callback_data) for text, callback_data in row))
+    return markup.to_json()
+
+
+# Все статические меню FAQ, отрисованные один раз для конкретной модели.
+# При перезагрузке FAQ создается новый экземпляр; меню и ответы подкатегорий,
+# которые не изменились и остались на своем месте, берутся из предыдущего.
+# popularity (id вопроса -> число просмотров) задает порядок вопросов
+# в подкатегории: сначала популярные, при равенстве - порядок в faq.json.
+# Вопросы подкатегории разбиты на страницы по QUESTIONS_PER_PAGE.
+class Menus:
+    def __init__(self, faq, previous=None, popularity=None):
+        self.faq = faq
+        self.popularity = popularity or {}
+        self.categories = RenderedMenu(escape_markdown("📚 Выбери категорию:"), self._render_categories())
+        self.subcategories = {}
+        self.questions = {}
+        self.answers = {}
+        self.rendered_by_key = {}
+        self.reused_subcategories = 0
+        previous_rendered = previous.rendered_by_key if previous is not None else {}
+        for category in faq.categories:
+            self.subcategories[category.index] = self._render_subcategories(category)
+            for subcategory in category.subcategories:
+                ordered = self._ordered(subcategory)
+                key = (category.index, subcategory.index, subcategory.signature, tuple(q.id for q in ordered))
+                rendered = previous_rendered.get(key)
+                if rendered is None:
+                    rendered = (self._render_questions(subcategory, ordered), self._render_answers(subcategory))
+                else:
+                    self.reused_subcategories += 1
+                self.rendered_by_key[key] = rendered
+                self.questions[(category.index, subcategory.index)] = rendered[0]
+                self.answers.update(rendered[1])
+
+    def _render_categories(self):
+        buttons = [(f"📚 {category.name}", encode("category", category.index)) for category in self.faq.categories]
+        buttons.append(("🔍 Поиск по ключевому слову", encode("search")))
+        return _serialize(buttons)
+
+    def _render_subcategories(self, category):
+        buttons = [
+            (f"📌 {subcategory.name}", encode("subcategory", category.index, subcategory.index, 0))
+            for subcategory in category.subcategories
+        ]
+        if category.name == "Абитуриенту":
+            buttons.append(("📋 Оставить заявку", encode("apply")))
+        buttons.append(("⬅️ Назад", encode("categories")))
+        return RenderedMenu(escape_markdown(f"✨ Выбери подкатегорию в '{category.name}':"), _serialize(buttons))
+
+    def _ordered(self, subcategory):
+        if not self.popularity:
+            return subcategory.questions
+        return sorted(subcategory.questions, key=lambda question: -self.popularity.get(question.id, 0))
+
+    # Страницы списка вопросов: текст и клавиатура каждой страницы
+    def _render_questions(self, subcategory, ordered):
+        category_index = subcategory.category.index
+        pages_count = max(1, -(-len(ordered) // QUESTIONS_PER_PAGE))
+        pages = []
+        for page in range(pages_count):
+            first = page * QUESTIONS_PER_PAGE
+            questions = ordered[first:first + QUESTIONS_PER_PAGE]
+            text = f"✨ *{escape_markdown(subcategory.name)}*\n\n"
+            for number, question in enumerate(questions, first + 1):
+                text += f"_{number}\\. {escape_markdown(question.question)} ❓_\n"
+            if pages_count > 1:
+                text += f"\nСтраница {page + 1} из {pages_count}\\."
+            text += "\nВыберите номер вопроса или вернитесь назад\\."
+            buttons = [(f"❓ Вопрос {number}", encode("question", question.id))
+                       for number, question in enumerate(questions, first + 1)]
+            navigation = []
+            if page > 0:
+                navigation.append((f"◀️ Стр. {page}", encode("subcategory", category_index, subcategory.index, page - 1)))
+            if page + 1 < pages_count:
+                navigation.append((f"Стр. {page + 2} ▶️", encode("subcategory", category_index, subcategory.index, page + 1)))
+            if navigation:
+                buttons.append(navigation)
+            buttons.append(("⬅️ Назад", encode("category", category_index)))
+            pages.append(RenderedMenu(text, _serialize(buttons)))
+        return tuple(pages)
+
+    def _render_answers(self, subcategory):
+        return {
+            question.id: escape_markdown(f"❓ Вопрос: {question.question}\n\n✅ Ответ: {question.answer}")
+            for question in subcategory.questions
+        }
+
+    # Доступ к меню: при отсутствии возвращается None
+    def subcategory_menu(self, cat_index):
+        return self.subcategories.get(cat_index)
+
+    def questions_menu(self, cat_index, subcat_index, page=0):
+        pages = self.questions.get((cat_index, subcat_index))
+        if pages is None or not 0 <= page < len(pages):
+            return None
+        return pages[page]
+
+    def answer_text(self, question_id):
+        return self.answers.get(question_id)
+
+
+# Список найденных вопросов с кнопками (зависит от запроса, поэтому не кэшируется)
+def render_search_results(title, questions):
+    text = f"{title}\n\n"
+    for i, question in enumerate(questions, 1):
+        text += f"_{i}\\. {escape_markdown(question.question)} ❓_\n"
+    buttons = [(f"❓ Вопрос {i}", encode("question", question.id)) for i, question in enumerate(questions, 1)]
+    buttons.append(("⬅️ Назад", encode("categories")))
+    return RenderedMenu(text, _serialize(buttons))
@@ -0,0 +1,199 @@
+import functools
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# Доля отладочных сообщений на горячих путях, которые действительно пишутся в лог
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
+
+# Границы корзин гистограмм задержек, секунды
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Каждый воркер gunicorn отдает /metrics только за себя, поэтому все ряды
+# помечаются pid процесса; суммировать по воркерам - sum without (pid)
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + [("pid", os.getpid())] + list(extra)
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return lines
+
+
+# Счетчик (только растет)
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def total(self):
+        with self._lock:
+            return sum(self._values.values())
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+# Гистограмма (корзины, сумма, количество)
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._values = {}
+
+    def observe(self, amount, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if amount <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += amount
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((key, ([*state[0]], state[1], state[2])) for key, state in self._values.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = _format_labels(self.labelnames, key, (("le", _format_value(bound)),))
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+# Показатель, значение которого вычисляется в момент выгрузки
+class CallbackGauge(_Metric):
+    type_name = "gauge"
+
+    def __init__(self, name, documentation, callback):
+        super().__init__(name, documentation)
+        self.callback = callback
+
+    def _samples(self):
+        try:
+            value = self.callback()
+        except Exception:
+            return []
+        return [f"{self.name}{_format_labels((), ())} {_format_value(value)}"]
+
+
+# Счетчик, значение которого берется из чужой статистики (только растет)
+class CallbackCounter(CallbackGauge):
+    type_name = "counter"
+
+
+# Текст в формате Prometheus для маршрута /metrics
+def render():
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Декоратор: время работы и исключения обработчика (обработчики, которые
+# сами перехватывают исключения, увеличивают HANDLER_ERRORS в except)
+def instrumented(handler_name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                HANDLER_ERRORS.inc(handler=handler_name)
+                raise
+            finally:
+                HANDLER_SECONDS.observe(time.perf_counter() - started, handler=handler_name)
+        return wrapper
+    return decorator
+
+
+# Отладочный лог с выборкой: аргументы форматируются только если сообщение пишется
+def log_sampled(logger, message, *args):
+    if logger.isEnabledFor(logging.DEBUG) and random.random() < LOG_SAMPLE_RATE:
+        logger.debug(message, *args)
+
+
+# Метрики бота
+WEBHOOK_REQUESTS = Counter("bot_webhook_requests_total", "Запросы к вебхуку по режиму и коду ответа", ("mode", "status"))
+WEBHOOK_SECONDS = Histogram("bot_webhook_seconds", "Время ответа маршрута вебхука", ("mode",))
+UPDATE_SECONDS = Histogram("bot_update_seconds", "Время обработки обновления", ("type", "prefix"))
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Время работы обработчиков", ("handler",))
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Исключения в обработчиках", ("handler",))
+SEARCH_SECONDS = Histogram("bot_search_seconds", "Время search_questions")
+SEARCH_RESULTS = Counter("bot_search_total", "Поисковые запросы по наличию результатов", ("result",))
+FREE_TEXT_ANSWERS = Counter("bot_free_text_total", "Свободные вопросы по виду ответа", ("result",))
+TELEGRAM_API_SECONDS = Histogram("bot_telegram_api_seconds", "Время запросов к Telegram Bot API", ("method",))
+TELEGRAM_API_REQUESTS = Counter("bot_telegram_api_requests_total", "Запросы к Telegram Bot API", ("method", "status"))
+TELEGRAM_THROTTLE_SECONDS = Histogram("bot_telegram_throttle_seconds", "Ожидание лимитов перед вызовом Bot API")
+TELEGRAM_RETRIES = Counter("bot_telegram_retries_total", "Повторы вызовов Bot API после 429", ("method",))
+TELEGRAM_DEFERRED = Counter("bot_telegram_deferred_total", "Вызовы Bot API, отложенные в фоновый поток из-за лимитов", ("result",))
+TELEGRAM_COALESCED = Counter("bot_telegram_coalesced_total", "Отброшенные лишние вызовы Bot API", ("operation",))
+APPS_SCRIPT_SECONDS = Histogram("bot_apps_script_seconds", "Время POST-запросов в Apps Script")
+APPS_SCRIPT_REQUESTS = Counter("bot_apps_script_requests_total", "POST-запросы в Apps Script по результату", ("result",))
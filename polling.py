@@ -0,0 +1,150 @@
+import logging
+import os
+import signal
+import threading
+import time
+from dispatcher import UpdateDispatcher
+
+logger = logging.getLogger(__name__)
+
+# Больше Bot API за один getUpdates не отдает
+MAX_BATCH_SIZE = 100
+
+
+# Получение обновлений через getUpdates вместо вебхука.
+# Обновления забираются пачками и раздаются пулу UpdateDispatcher
+# (порядок внутри чата сохраняется). Telegram считает обновление доставленным,
+# когда getUpdates вызывается со смещением больше его update_id, поэтому
+# смещение не уходит дальше самого раннего еще не обработанного обновления:
+# после перезапуска необработанные обновления будут получены снова.
+# Повторно полученные обновления, которые уже в работе, пропускаются.
+class PollingRunner:
+    def __init__(self, process, fetch, workers=4, queue_size=100, batch_size=MAX_BATCH_SIZE,
+                 poll_timeout=25, idle_wait=0.5, error_backoff=3.0):
+        self.fetch = fetch
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self.poll_timeout = poll_timeout
+        self.idle_wait = idle_wait
+        self.error_backoff = error_backoff
+        self.dispatcher = UpdateDispatcher(self._process, workers=workers, queue_size=queue_size, name="polling-worker")
+        self._process_update = process
+        self._inflight = set()
+        self._next_offset = 0
+        self._completed = 0
+        self._changed = threading.Condition()
+        self._stop = threading.Event()
+        self._stats = {"fetches": 0, "fetched": 0, "dispatched": 0, "duplicates": 0, "fetch_errors": 0}
+
+    def run(self):
+        self.dispatcher.start()
+        logger.info(f"Long polling запущен: пачки по {self.batch_size}, обработчиков {self.dispatcher.stats()['workers']}")
+        while not self._stop.is_set():
+            with self._changed:
+                offset = self._offset()
+                busy = bool(self._inflight)
+                completed = self._completed
+            try:
+                # Пока есть необработанные обновления, Telegram отвечает сразу
+                updates = self.fetch(offset, self.batch_size, 0 if busy else self.poll_timeout)
+            except Exception as e:
+                self._stats["fetch_errors"] += 1
+                logger.error(f"Ошибка getUpdates: {e}")
+                self._stop.wait(self.error_backoff)
+                continue
+            self._stats["fetches"] += 1
+            self._stats["fetched"] += len(updates)
+            if not self._dispatch(updates):
+                # Нового ничего нет, а повторный запрос вернул бы те же обновления:
+                # ждем, пока какое-нибудь из них не будет обработано
+                with self._changed:
+                    self._changed.wait_for(lambda: self._completed != completed or self._stop.is_set(), self.idle_wait)
+        self.dispatcher.stop()
+        self._commit()
+        logger.info(f"Long polling остановлен: {self.stats()}")
+
+    def stop(self):
+        self._stop.set()
+        with self._changed:
+            self._changed.notify_all()
+
+    def stats(self):
+        with self._changed:
+            stats = dict(self._stats, inflight=len(self._inflight), offset=self._offset())
+        stats["dispatcher"] = self.dispatcher.stats()
+        return stats
+
+    # Смещение для getUpdates: самое раннее необработанное обновление
+    def _offset(self):
+        return min(self._inflight) if self._inflight else self._next_offset
+
+    def _dispatch(self, updates):
+        dispatched = 0
+        for update in updates:
+            update_id = update['update_id']
+            with self._changed:
+                if update_id in self._inflight or update_id < self._next_offset:
+                    self._stats["duplicates"] += 1
+                    continue
+                self._inflight.add(update_id)
+            if not self.dispatcher.submit(update):
+                # Очередь заполнена: это и следующие обновления заберем позже,
+                # иначе следующие обновления того же чата обогнали бы это
+                with self._changed:
+                    self._inflight.discard(update_id)
+                break
+            with self._changed:
+                self._next_offset = update_id + 1
+            dispatched += 1
+        self._stats["dispatched"] += dispatched
+        return dispatched
+
+    def _process(self, update):
+        try:
+            self._process_update(update)
+        finally:
+            with self._changed:
+                self._inflight.discard(update['update_id'])
+                self._completed += 1
+                self._changed.notify_all()
+
+    # Подтверждение обработанных обновлений перед выходом
+    def _commit(self):
+        with self._changed:
+            offset = self._offset()
+        if not offset:
+            return
+        try:
+            self.fetch(offset, 1, 0)
+        except Exception as e:
+            logger.error(f"Не удалось подтвердить обновления до {offset}: {e}")
+
+
+# Запуск: python polling.py (настройки бота - те же переменные окружения,
+# TELEGRAM_API_URL позволяет работать с локальной заглушкой Bot API)
+def main():
+    from telebot import apihelper
+    import bot
+
+    # apihelper заменяет нулевой таймаут значением по умолчанию, поэтому минимум - 1 с
+    def fetch(offset, limit, timeout):
+        return apihelper.get_updates(bot.TOKEN, offset, limit, long_polling_timeout=timeout or 1)
+
+    runner = PollingRunner(
+        bot.process_update_paced,
+        fetch,
+        workers=int(os.getenv("POLLING_WORKERS", "4")),
+        queue_size=int(os.getenv("POLLING_QUEUE_SIZE", "100")),
+        batch_size=int(os.getenv("POLLING_BATCH_SIZE", str(MAX_BATCH_SIZE))),
+        poll_timeout=int(os.getenv("POLLING_TIMEOUT", "25")),
+    )
+    signal.signal(signal.SIGTERM, lambda *args: runner.stop())
+    signal.signal(signal.SIGINT, lambda *args: runner.stop())
+    # getUpdates не работает, пока установлен вебхук
+    bot.bot.remove_webhook()
+    started = time.perf_counter()
+    runner.run()
+    logger.info(f"Время работы: {time.perf_counter() - started:.1f} с")
+
+
+if __name__ == "__main__":
+    main()
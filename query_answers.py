@@ -0,0 +1,87 @@
+import threading
+from collections import OrderedDict
+from search_index import query_words, query_terms
+
+# Ограничения на запрос: длинное сообщение не должно превращаться в долгий поиск
+MAX_QUERY_LENGTH = 200
+MAX_QUERY_WORDS = 12
+
+
+# Результат поиска: найденные вопросы и можно ли сразу отвечать первым из них
+class SearchOutcome:
+    __slots__ = ('questions', 'confident')
+
+    def __init__(self, questions, confident):
+        self.questions = questions
+        self.confident = confident
+
+
+EMPTY_OUTCOME = SearchOutcome((), False)
+
+
+# Поиск по тексту пользователя с кэшем результатов.
+# Ключ кэша - набор нормальных форм значимых слов запроса, поэтому
+# "Есть ли общежитие?" и "общежитие" считаются одним запросом. Кэш относится к одному снимку FAQ
+# и сбрасывается, как только обработчики получают новый.
+# backend(snapshot) возвращает поисковые индексы снимка: первый - основной
+# (по умолчанию - только индекс по леммам), остальные переупорядочивают
+# (rerank) его результаты, если уверенного ответа он не дал.
+class QueryAnswerer:
+    def __init__(self, normalize, limit=5, cache_size=2000, backend=None):
+        self.normalize = normalize
+        self.backend = backend or (lambda snapshot: (snapshot.search_index,))
+        self.limit = limit
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    # Нормальные формы значимых слов запроса через пробел (пустая строка -
+    # искать нечего: запрос из одних служебных слов)
+    def query_key(self, query):
+        return " ".join(sorted(query_terms(" ".join(self._words(query)), self.normalize)))
+
+    def _words(self, query):
+        return query_words(str(query)[:MAX_QUERY_LENGTH])[:MAX_QUERY_WORDS]
+
+    def search(self, snapshot, query):
+        words = self._words(query)
+        key = " ".join(sorted(query_terms(" ".join(words), self.normalize)))
+        if not key:
+            return EMPTY_OUTCOME
+        with self._lock:
+            if snapshot is not self._snapshot:
+                self._cache.clear()
+                self._snapshot = snapshot
+            outcome = self._cache.get(key)
+            if outcome is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return outcome
+            self.misses += 1
+        primary, *rerankers = self.backend(snapshot)
+        text = " ".join(words)
+        scored = primary.search_scored(text, self.limit)
+        confident = primary.is_confident(scored)
+        if not confident:
+            for index in rerankers:
+                scored = index.rerank(text, scored, self.limit)
+        outcome = SearchOutcome(tuple(question for question, _, _ in scored), confident) if scored else EMPTY_OUTCOME
+        with self._lock:
+            if snapshot is self._snapshot:
+                self._cache[key] = outcome
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return outcome
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._cache),
+            "maxsize": self.cache_size,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
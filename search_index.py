@@ -0,0 +1,291 @@
+import math
+import re
+from collections import defaultdict
+
+# Разбиение текста на слова (без знаков препинания)
+WORD_RE = re.compile(r'\w+')
+
+# Множители совпадения слова запроса с леммой FAQ: точная лемма,
+# префикс леммы, подстрока внутри леммы, лемма с опечаткой (делится на расстояние)
+EXACT_WEIGHT = 1.0
+PREFIX_WEIGHT = 0.7
+INFIX_WEIGHT = 0.4
+FUZZY_WEIGHT = 0.6
+
+# Слова из текста вопроса весят больше, чем слова из ответа
+QUESTION_WEIGHT = 2.0
+ANSWER_WEIGHT = 1.0
+
+# Параметры BM25: насыщение частоты слова и нормировка по длине поля
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Короткие слова запроса ("в", "на") не ищутся как начало или часть
+# других слов, иначе совпадают почти со всем
+MIN_PREFIX_LENGTH = 2
+MIN_INFIX_LENGTH = 3
+# Слова запроса короче этого ("в", "а", "и") не ищутся совсем
+MIN_TERM_LENGTH = 2
+
+# Служебные слова (нормальные формы): предлоги, союзы, частицы, местоимения,
+# вопросительные и модальные слова. В запросе они не ищутся и не учитываются
+# в доле совпавших слов, иначе "есть ли ..." или "можно ли ..." совпадают
+# с любым вопросом, начинающимся так же.
+STOP_WORDS = frozenset("""
+    без в во для до за из к ко на над о об от по под при про с со у через между перед после
+    и а но или да либо что чтобы если когда как так тоже также ли же бы не ни ну вот уж ещё еще
+    только даже лишь пожалуйста спасибо привет здравствуйте
+    я ты вы он она оно мы они себя мой твой ваш наш свой его её ее их это этот тот такой весь сам
+    кто какой каков который чей где куда откуда почему зачем сколько
+    можно нужно надо нельзя быть есть бывать
+""".split())
+# Слово короче этого, если оно есть в FAQ целиком (аббревиатуры "спо", "во"),
+# не ищется как начало или часть других слов
+MIN_EXPAND_LENGTH = 4
+# Слова короче этого не исправляются как опечатки
+MIN_FUZZY_LENGTH = 4
+# Сколько лемм с наибольшим числом общих триграмм проверяется на расстояние
+FUZZY_CANDIDATES = 30
+# Сколько слов запроса помнит кэш совпадений
+MATCH_CACHE_SIZE = 4096
+
+# Уверенный ответ: совпали все значимые слова запроса, вес лучшего вопроса
+# не меньше MIN_CONFIDENT_SCORE и в CONFIDENT_MARGIN раз больше, чем у следующего
+MIN_CONFIDENT_SCORE = 3.0
+CONFIDENT_MARGIN = 1.5
+
+
+def tokenize(text):
+    return WORD_RE.findall(str(text).lower())
+
+
+# Слова запроса, по которым ведется поиск (без однобуквенных)
+def query_words(text):
+    return [word for word in tokenize(text) if len(word) >= MIN_TERM_LENGTH]
+
+
+# Значимые слова запроса: нормальная форма -> исходное слово (без служебных)
+def query_terms(text, normalize):
+    terms = {}
+    for word in query_words(text):
+        term = normalize(word)
+        if term not in STOP_WORDS and term not in terms:
+            terms[term] = word
+    return terms
+
+
+# Допустимое число опечаток в слове: одна для коротких слов, две для длинных
+def max_typos(word):
+    if len(word) < MIN_FUZZY_LENGTH:
+        return 0
+    return 1 if len(word) <= 6 else 2
+
+
+# Триграммы слова с границами: "$$о", "$от", ..., "ск$"
+def trigrams(word):
+    padded = f"$${word}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+# Расстояние Дамерау-Левенштейна (с перестановкой соседних букв);
+# если оно заведомо больше limit, возвращается limit + 1
+def edit_distance(a, b, limit):
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+# Инвертированный индекс лемм FAQ с ранжированием BM25.
+# Сегменты по подкатегориям хранят только частоты лемм в полях вопроса и ответа
+# и длины полей; готовые сегменты неизмененных подкатегорий (из предыдущего
+# индекса или снимка) переиспользуются. Из объединенных частот один раз
+# считается вклад каждой леммы в каждый вопрос (BM25 с весами полей),
+# подстроки лемм и триграммы для поиска с опечатками. Поиск сводится
+# к обращениям к словарям, морфологический разбор нужен только для слов запроса.
+class SearchIndex:
+    def __init__(self, faq, normalize, segments=None):
+        self.normalize = normalize
+        self.questions = {}
+        self.order = {}
+        self.segments = {}
+        self.reused_segments = 0
+        frequencies = defaultdict(dict)
+        lengths = {}
+        for subcategory in faq.iter_subcategories():
+            segment = segments.get(subcategory.signature) if segments else None
+            if segment is None:
+                segment = self._build_segment(subcategory)
+            else:
+                self.reused_segments += 1
+            self.segments[subcategory.signature] = segment
+            for lemma, entries in segment["frequencies"].items():
+                frequencies[lemma].update(entries)
+            lengths.update(segment["lengths"])
+            for question in subcategory.questions:
+                self.questions[question.id] = question
+                self.order[question.id] = len(self.order)
+        self.postings = self._build_postings(frequencies, lengths)
+        self.fragments = self._build_fragments(self.postings)
+        self.trigrams = self._build_trigrams(self.postings)
+        self._matches = {}
+
+    # Сегмент подкатегории: лемма -> {id вопроса: (частота в вопросе, частота в ответе)}
+    # и id вопроса -> (длина вопроса, длина ответа) в словах
+    def _build_segment(self, subcategory):
+        frequencies = defaultdict(dict)
+        lengths = {}
+        for question in subcategory.questions:
+            question_lemmas = [self.normalize(word) for word in tokenize(question.question)]
+            answer_lemmas = [self.normalize(word) for word in tokenize(question.answer)]
+            for lemma in question_lemmas:
+                tf_question, tf_answer = frequencies[lemma].get(question.id, (0, 0))
+                frequencies[lemma][question.id] = (tf_question + 1, tf_answer)
+            for lemma in answer_lemmas:
+                tf_question, tf_answer = frequencies[lemma].get(question.id, (0, 0))
+                frequencies[lemma][question.id] = (tf_question, tf_answer + 1)
+            lengths[question.id] = (len(question_lemmas), len(answer_lemmas))
+        return {"frequencies": dict(frequencies), "lengths": lengths}
+
+    # Вклад леммы в вопрос: idf * (взвешенная сумма BM25 по полям)
+    def _build_postings(self, frequencies, lengths):
+        total = len(lengths) or 1
+        avg_question = sum(length[0] for length in lengths.values()) / total or 1
+        avg_answer = sum(length[1] for length in lengths.values()) / total or 1
+        postings = {}
+        for lemma, entries in frequencies.items():
+            df = len(entries)
+            idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+            scores = {}
+            for question_id, (tf_question, tf_answer) in entries.items():
+                len_question, len_answer = lengths[question_id]
+                score = (QUESTION_WEIGHT * _bm25_tf(tf_question, len_question, avg_question)
+                         + ANSWER_WEIGHT * _bm25_tf(tf_answer, len_answer, avg_answer))
+                scores[question_id] = idf * score
+            postings[lemma] = scores
+        return postings
+
+    # Все подстроки лемм, чтобы сохранить прежнюю семантику "keyword in word"
+    def _build_fragments(self, lemmas):
+        fragments = defaultdict(set)
+        for lemma in lemmas:
+            for start in range(len(lemma)):
+                for end in range(start + 1, len(lemma) + 1):
+                    fragments[lemma[start:end]].add(lemma)
+        return {fragment: tuple(lemmas) for fragment, lemmas in fragments.items()}
+
+    # Триграмма -> леммы, в которых она встречается (кандидаты для опечаток)
+    def _build_trigrams(self, lemmas):
+        index = defaultdict(list)
+        for lemma in lemmas:
+            if len(lemma) >= MIN_FUZZY_LENGTH - 1 and not lemma.isdigit():
+                for trigram in trigrams(lemma):
+                    index[trigram].append(lemma)
+        return {trigram: tuple(lemmas) for trigram, lemmas in index.items()}
+
+    # Леммы FAQ, подходящие под слово запроса, с множителем совпадения.
+    # Результат запоминается: повторные запросы не пересчитывают опечатки.
+    def matches(self, term, word=None):
+        key = (term, word)
+        found = self._matches.get(key)
+        if found is None:
+            found = self._find_matches(term, word)
+            if len(self._matches) >= MATCH_CACHE_SIZE:
+                self._matches.clear()
+            self._matches[key] = found
+        return found
+
+    def _find_matches(self, term, word):
+        if len(term) < MIN_EXPAND_LENGTH and term in self.postings:
+            return {term: EXACT_WEIGHT}
+        found = {}
+        for lemma in self.fragments.get(term, ()):
+            if term == lemma:
+                found[lemma] = EXACT_WEIGHT
+            elif lemma.startswith(term) and len(term) >= MIN_PREFIX_LENGTH:
+                found[lemma] = PREFIX_WEIGHT
+            elif len(term) >= MIN_INFIX_LENGTH:
+                found[lemma] = INFIX_WEIGHT
+        if any(weight >= PREFIX_WEIGHT for weight in found.values()):
+            return found
+        # Точного совпадения нет: ищем леммы на расстоянии одной-двух опечаток
+        # и от нормальной формы, и от исходного слова (pymorphy3 не всегда
+        # угадывает нормальную форму слова с ошибкой)
+        for variant in {term, word or term}:
+            for lemma, distance in self._fuzzy(variant):
+                weight = FUZZY_WEIGHT / distance
+                if found.get(lemma, 0) < weight:
+                    found[lemma] = weight
+        return found
+
+    def _fuzzy(self, word):
+        limit = max_typos(word)
+        if not limit:
+            return []
+        shared = defaultdict(int)
+        for trigram in trigrams(word):
+            for lemma in self.trigrams.get(trigram, ()):
+                shared[lemma] += 1
+        candidates = sorted(shared, key=lambda lemma: -shared[lemma])[:FUZZY_CANDIDATES]
+        result = []
+        for lemma in candidates:
+            distance = edit_distance(word, lemma, limit)
+            if 0 < distance <= limit:
+                result.append((lemma, distance))
+        return result
+
+    def _term_scores(self, term, word):
+        scores = {}
+        for lemma, weight in self.matches(term, word).items():
+            for question_id, impact in self.postings[lemma].items():
+                score = weight * impact
+                if scores.get(question_id, 0) < score:
+                    scores[question_id] = score
+        return scores
+
+    # Результаты с оценками: [(вопрос, суммарный вес, доля совпавших слов запроса)]
+    def search_scored(self, query, limit=5):
+        terms = query_terms(query, self.normalize)
+        coverage = defaultdict(int)
+        totals = defaultdict(float)
+        for term, word in terms.items():
+            for question_id, score in self._term_scores(term, word).items():
+                coverage[question_id] += 1
+                totals[question_id] += score
+        # Больше совпавших слов запроса -> выше; затем по весу; затем по порядку в файле
+        ranked = sorted(coverage, key=lambda qid: (-coverage[qid], -totals[qid], self.order[qid]))
+        return [(self.questions[qid], totals[qid], coverage[qid] / len(terms)) for qid in ranked[:limit]]
+
+    def search(self, query, limit=5):
+        return [question for question, _, _ in self.search_scored(query, limit)]
+
+    # Можно ли сразу отвечать первым результатом search_scored: совпали все
+    # значимые слова запроса, а следующий вопрос (с поправкой на долю
+    # совпавших у него слов) заметно слабее
+    def is_confident(self, scored):
+        if not scored:
+            return False
+        _, score, coverage = scored[0]
+        if coverage < 1.0 or score < MIN_CONFIDENT_SCORE:
+            return False
+        if len(scored) == 1:
+            return True
+        _, next_score, next_coverage = scored[1]
+        return score >= CONFIDENT_MARGIN * next_score * next_coverage
+
+
+def _bm25_tf(tf, length, average):
+    if not tf:
+        return 0.0
+    return tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length / average))
@@ -0,0 +1,221 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import sys
+from collections import Counter
+from search_index import tokenize, query_words, QUESTION_WEIGHT, STOP_WORDS
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Версия формата артефакта; при изменении артефакт просто пересобирается
+ARTIFACT_VERSION = 1
+
+# Размерность скрытого пространства (не больше ранга матрицы FAQ). Чем она
+# меньше, тем сильнее сближаются вопросы с общими по смыслу словами;
+# при размерности, равной числу вопросов, поиск сводится к обычному TF-IDF
+DEFAULT_DIMENSIONS = 16
+
+# Вопросы с меньшим косинусным сходством не показываются
+MIN_SIMILARITY = 0.2
+# Доля сходства LSA в общей оценке при переупорядочивании результатов
+# поиска по леммам (остальное - относительный вес BM25 с учетом доли
+# совпавших слов)
+SEMANTIC_WEIGHT = 0.8
+
+DOCUMENTS_FILE = "documents.npy"
+TERMS_FILE = "terms.npy"
+META_FILE = "meta.json"
+
+
+# Отпечаток содержимого FAQ: подписи всех подкатегорий по порядку
+def faq_fingerprint(faq):
+    digest = hashlib.sha1()
+    for subcategory in faq.iter_subcategories():
+        digest.update(subcategory.signature.encode('ascii'))
+    return digest.hexdigest()
+
+
+# Сборка артефакта (офлайн): TF-IDF вопросов и ответов и усеченное SVD.
+# documents.npy - нормированные векторы вопросов в скрытом пространстве,
+# terms.npy - вектор каждой леммы (уже умноженный на idf), так что вектор
+# запроса - сумма строк terms.npy, а сходство - одно умножение матрицы на вектор.
+# related - строки с группами близких слов: они участвуют в SVD как
+# дополнительные документы (без них LSA не знает слов, которых нет в FAQ,
+# например "платить" для "денежного довольствия"), но в поиске не выдаются.
+def build_semantic_index(faq, artifact_dir, normalize, dimensions=DEFAULT_DIMENSIONS, related=()):
+    if np is None:
+        raise RuntimeError("Для семантического поиска нужен numpy")
+    questions = list(faq.iter_questions())
+    counts = []
+    for question in questions:
+        weighted = Counter()
+        for word in tokenize(question.question):
+            weighted[normalize(word)] += QUESTION_WEIGHT
+        for word in tokenize(question.answer):
+            weighted[normalize(word)] += 1
+        counts.append(weighted)
+    for line in related:
+        counts.append(Counter(normalize(word) for word in tokenize(line)))
+    vocabulary = sorted({lemma for weighted in counts for lemma in weighted})
+    positions = {lemma: i for i, lemma in enumerate(vocabulary)}
+    matrix = np.zeros((len(counts), len(vocabulary)), dtype=np.float64)
+    for row, weighted in enumerate(counts):
+        for lemma, count in weighted.items():
+            matrix[row, positions[lemma]] = 1 + math.log(count)
+    df = np.count_nonzero(matrix, axis=0)
+    idf = np.log((1 + len(counts)) / (1 + df)) + 1
+    matrix *= idf
+    _, singular, vt = np.linalg.svd(matrix, full_matrices=False)
+    k = max(1, min(dimensions, int(np.count_nonzero(singular > 1e-9))))
+    basis = vt[:k].T
+    documents = _normalize_rows(matrix[:len(questions)] @ basis)
+    terms = idf[:, None] * basis
+    os.makedirs(artifact_dir, exist_ok=True)
+    np.save(os.path.join(artifact_dir, DOCUMENTS_FILE), documents.astype(np.float32))
+    np.save(os.path.join(artifact_dir, TERMS_FILE), terms.astype(np.float32))
+    meta = {
+        "version": ARTIFACT_VERSION,
+        "fingerprint": faq_fingerprint(faq),
+        "dimensions": k,
+        "question_ids": [question.id for question in questions],
+        "related": len(related),
+        "vocabulary": vocabulary,
+    }
+    with open(os.path.join(artifact_dir, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+    return meta
+
+
+# Группы близких слов из файла: по группе на строку, # - комментарий
+def read_related(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+# Загрузка артефакта через mmap: матрицы не копируются в память процесса,
+# все воркеры gunicorn читают одни и те же страницы файлового кэша.
+# None, если numpy нет, артефакта нет или он собран для другой версии FAQ.
+def load_semantic_index(faq, artifact_dir, normalize):
+    if np is None:
+        logger.warning("numpy не установлен, семантический поиск недоступен")
+        return None
+    try:
+        with open(os.path.join(artifact_dir, META_FILE), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get("version") != ARTIFACT_VERSION or meta.get("fingerprint") != faq_fingerprint(faq):
+            logger.warning(f"Семантический индекс {artifact_dir} устарел, используется поиск по леммам")
+            return None
+        documents = np.load(os.path.join(artifact_dir, DOCUMENTS_FILE), mmap_mode='r')
+        terms = np.load(os.path.join(artifact_dir, TERMS_FILE), mmap_mode='r')
+    except FileNotFoundError:
+        logger.warning(f"Семантический индекс {artifact_dir} не найден, используется поиск по леммам")
+        return None
+    except Exception as e:
+        logger.error(f"Ошибка чтения семантического индекса {artifact_dir}: {e}")
+        return None
+    return SemanticIndex(faq, normalize, meta, documents, terms)
+
+
+# Поиск по близости в пространстве LSA. Интерфейс тот же, что у SearchIndex:
+# search_scored возвращает [(вопрос, сходство, доля известных слов запроса)].
+# Сам по себе индекс никогда не отвечает уверенно: на перефразированных
+# вопросах сходства лучших вопросов почти равны (0.94/0.94/0.91 для
+# "сколько платят курсантам"), а отрыв лидера не отличает верные ответы
+# от неверных. Поэтому он переупорядочивает неуверенные результаты поиска
+# по леммам (rerank), а прямой ответ дает только поиск по леммам.
+class SemanticIndex:
+    def __init__(self, faq, normalize, meta, documents, terms):
+        self.normalize = normalize
+        self.questions = [faq.question(question_id) for question_id in meta["question_ids"]]
+        self.rows = {question_id: i for i, question_id in enumerate(meta["question_ids"])}
+        self.positions = {lemma: i for i, lemma in enumerate(meta["vocabulary"])}
+        self.documents = documents
+        self.terms = terms
+
+    # Сходство запроса со всеми вопросами и доля известных слов запроса
+    # (None, если ни одного значимого слова запроса нет в словаре FAQ)
+    def _similarities(self, query):
+        lemmas = Counter(self.normalize(word) for word in query_words(query))
+        for lemma in STOP_WORDS.intersection(lemmas):
+            del lemmas[lemma]
+        rows = []
+        weights = []
+        for lemma, count in lemmas.items():
+            position = self.positions.get(lemma)
+            if position is not None:
+                rows.append(position)
+                weights.append(1 + math.log(count))
+        if not rows:
+            return None
+        vector = np.asarray(weights, dtype=np.float32) @ self.terms[rows]
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return None
+        return self.documents @ (vector / norm), len(rows) / len(lemmas)
+
+    def search_scored(self, query, limit=5):
+        found = self._similarities(query)
+        if found is None:
+            return []
+        similarities, coverage = found
+        limit = min(limit, len(similarities))
+        top = np.argpartition(-similarities, limit - 1)[:limit]
+        top = top[np.argsort(-similarities[top], kind='stable')]
+        return [
+            (self.questions[i], float(similarities[i]), coverage)
+            for i in top if similarities[i] >= MIN_SIMILARITY
+        ]
+
+    def search(self, query, limit=5):
+        return [question for question, _, _ in self.search_scored(query, limit)]
+
+    def is_confident(self, scored):
+        return False
+
+    # Переупорядочивание результатов другого индекса (вопрос, вес, доля слов):
+    # общая оценка - взвешенная сумма сходства LSA и относительного веса
+    # (вес * доля совпавших слов, деленные на максимум); к кандидатам
+    # добавляются ближайшие по LSA вопросы
+    def rerank(self, query, scored, limit=5):
+        found = self._similarities(query)
+        if found is None:
+            return scored
+        similarities, coverage = found
+        relevance = {question.id: score * matched for question, score, matched in scored}
+        best = max(relevance.values(), default=0) or 1
+        candidates = {question.id: (question, matched) for question, _, matched in scored}
+        for question, _, _ in self.search_scored(query, limit):
+            candidates.setdefault(question.id, (question, coverage))
+        fused = []
+        for question_id, (question, matched) in candidates.items():
+            score = (SEMANTIC_WEIGHT * float(similarities[self.rows[question_id]])
+                     + (1 - SEMANTIC_WEIGHT) * relevance.get(question_id, 0) / best)
+            fused.append((question, score, matched))
+        fused.sort(key=lambda item: -item[1])
+        return fused[:limit]
+
+
+if __name__ == "__main__":
+    from faq_model import load_faq_model
+    from lemmatizer import normal_form
+    faq_path = sys.argv[1] if len(sys.argv) > 1 else 'faq.json'
+    artifact_dir = sys.argv[2] if len(sys.argv) > 2 else 'faq_semantic'
+    related_path = sys.argv[3] if len(sys.argv) > 3 else 'faq_related.txt'
+    related = read_related(related_path) if os.path.exists(related_path) else []
+    result = build_semantic_index(load_faq_model(faq_path), artifact_dir, normal_form, related=related)
+    print(f"Семантический индекс {artifact_dir}: {len(result['question_ids'])} вопросов, "
+          f"{result['related']} групп близких слов, {len(result['vocabulary'])} лемм, "
+          f"размерность {result['dimensions']}")
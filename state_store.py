@@ -0,0 +1,112 @@
+import json
+import sqlite3
+import threading
+import time
+
+# Как часто (в записях) удалять просроченные состояния
+PURGE_EVERY = 200
+
+
+def _dumps(record):
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+
+
+# Состояние диалогов в памяти процесса (один воркер).
+# Запись чата - небольшой словарь: шаг диалога и собранные поля заявки.
+class MemoryStateStore:
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+        self._records = {}
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def get(self, chat_id):
+        chat_id = str(chat_id)
+        with self._lock:
+            item = self._records.get(chat_id)
+            if item is None:
+                return None
+            expires_at, payload = item
+            if expires_at < time.time():
+                del self._records[chat_id]
+                return None
+        return json.loads(payload)
+
+    def set(self, chat_id, record):
+        payload = _dumps(record)
+        with self._lock:
+            self._records[str(chat_id)] = (time.time() + self.ttl, payload)
+            self._writes += 1
+            if self._writes % PURGE_EVERY == 0:
+                self._purge()
+
+    def delete(self, chat_id):
+        with self._lock:
+            self._records.pop(str(chat_id), None)
+
+    def _purge(self):
+        now = time.time()
+        for chat_id in [chat_id for chat_id, (expires_at, _) in self._records.items() if expires_at < now]:
+            del self._records[chat_id]
+
+    def __len__(self):
+        return len(self._records)
+
+
+# Состояние диалогов в файле SQLite: общее для всех воркеров и процессов на хосте
+class SqliteStateStore:
+    def __init__(self, path, ttl=3600):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS chat_state ("
+                "chat_id TEXT PRIMARY KEY, record TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, chat_id):
+        row = self._connection().execute(
+            "SELECT record FROM chat_state WHERE chat_id = ? AND expires_at >= ?",
+            (str(chat_id), time.time()),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, chat_id, record):
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO chat_state (chat_id, record, expires_at) VALUES (?, ?, ?)",
+                (str(chat_id), _dumps(record), time.time() + self.ttl),
+            )
+            self._writes += 1
+            if self._writes % PURGE_EVERY == 0:
+                connection.execute("DELETE FROM chat_state WHERE expires_at < ?", (time.time(),))
+
+    def delete(self, chat_id):
+        with self._connection() as connection:
+            connection.execute("DELETE FROM chat_state WHERE chat_id = ?", (str(chat_id),))
+
+    def __len__(self):
+        row = self._connection().execute(
+            "SELECT COUNT(*) FROM chat_state WHERE expires_at >= ?", (time.time(),)
+        ).fetchone()
+        return row[0]
+
+
+# Создание хранилища по строке настройки: "memory" или "sqlite:///путь/к/файлу"
+def create_state_store(url, ttl=3600):
+    if url == "memory":
+        return MemoryStateStore(ttl)
+    if url.startswith("sqlite:///"):
+        return SqliteStateStore(url[len("sqlite:///"):], ttl)
+    raise ValueError(f"Неизвестное хранилище состояний: {url}")
@@ -0,0 +1,279 @@
+import fcntl
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+import requests
+from requests.adapters import HTTPAdapter
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Сколько файлов-спулов может быть у одного пути (по одному на процесс gunicorn)
+MAX_SPOOL_SLOTS = 16
+
+# Результат отправки: принято, временная ошибка (повторить), отказ Apps Script
+SENT = "sent"
+FAILED = "failed"
+REJECTED = "rejected"
+
+# Явный окончательный отказ в ответе Apps Script: {"status": "rejected", ...}.
+# Любой другой неуспешный ответ с кодом 2xx считается временной ошибкой.
+REJECTED_STATUS = "rejected"
+# Коды 4xx, после которых повтор имеет смысл
+RETRYABLE_CLIENT_ERRORS = (408, 425, 429)
+
+
+# Фоновая отправка заявок в Apps Script.
+# Каждая заявка сначала дописывается в спул на диске, затем отправляется
+# рабочим потоком с таймаутами, повторами с экспоненциальной задержкой
+# и (по желанию) пачками. Подтвержденные заявки отмечаются в спуле.
+# После max_retries неудачных попыток пачка возвращается в очередь через
+# backoff_max секунд (недоступность Apps Script не теряет заявки до рестарта);
+# заявки, которые Apps Script явно отклонил, отмечаются в спуле как rejected
+# и больше не отправляются. Неподтвержденные переотправляются после перезапуска,
+# в том числе из спулов других слотов, которые никто не держит.
+class ApplicationSubmitter:
+    def __init__(self, url, spool_path, timeout=(5, 20), max_retries=6,
+                 backoff_base=1.0, backoff_max=60.0, batch_size=1, batch_wait=0.5):
+        self.url = url
+        self.spool_path = spool_path
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = batch_wait
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._spool = None
+        self._thread = None
+        self._sending = 0
+
+    # Запуск: захват файла спула и повторная постановка неотправленных заявок
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._spool = self._open_spool()
+            orphans = self._adopt_orphans()
+            pending = self._compact_spool()
+            # Перенесенные записи уже на диске в своем спуле: чужие файлы можно очистить
+            for orphan in orphans:
+                orphan.truncate(0)
+                orphan.close()
+            for application_id, application in pending:
+                self._queue.put((application_id, application))
+            if pending:
+                logger.info(f"Из спула восстановлено заявок: {len(pending)}")
+            self._thread = threading.Thread(target=self._run, name="application-submitter", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.session.close()
+        with self._lock:
+            if self._spool is not None:
+                self._spool.close()
+                self._spool = None
+
+    # Постановка заявки в очередь; возвращается сразу после записи в спул
+    def submit(self, application):
+        self.start()
+        application_id = uuid.uuid4().hex
+        self._append({"op": "add", "id": application_id, "data": application})
+        self._queue.put((application_id, application))
+        return application_id
+
+    # Заявки в очереди и в текущей пачке (в том числе ждущей повтора)
+    def pending_count(self):
+        return self._queue.qsize() + self._sending
+
+    def _slot_path(self, slot):
+        base, ext = os.path.splitext(self.spool_path)
+        return self.spool_path if slot == 0 else f"{base}.{slot}{ext}"
+
+    def _open_spool(self):
+        for slot in range(MAX_SPOOL_SLOTS):
+            path = self._slot_path(slot)
+            spool = open(path, 'a+', encoding='utf-8')
+            try:
+                fcntl.flock(spool, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                spool.close()
+                continue
+            logger.info(f"Спул заявок: {path}")
+            return spool
+        raise RuntimeError(f"Все файлы спула {self.spool_path} заняты")
+
+    # Спулы, которые не держит ни один процесс (например, после перезапуска
+    # с меньшим числом воркеров): их записи дописываются в свой спул, а сами
+    # файлы остаются заблокированными до очистки в start()
+    def _adopt_orphans(self):
+        orphans = []
+        for slot in range(MAX_SPOOL_SLOTS):
+            path = self._slot_path(slot)
+            if path == self._spool.name or not os.path.exists(path):
+                continue
+            orphan = open(path, 'r+', encoding='utf-8')
+            try:
+                fcntl.flock(orphan, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                orphan.close()
+                continue
+            records = orphan.read()
+            if records:
+                if not records.endswith("\n"):
+                    records += "\n"
+                self._spool.seek(0, os.SEEK_END)
+                self._spool.write(records)
+                logger.info(f"Перенесены записи из спула без владельца: {path}")
+            orphans.append(orphan)
+        return orphans
+
+    # Чтение спула и перезапись только неподтвержденных заявок
+    def _compact_spool(self):
+        self._spool.seek(0)
+        pending = {}
+        rejected = []
+        for line in self._spool:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logger.error(f"Поврежденная строка в спуле заявок: {line!r}")
+                continue
+            if record.get("op") == "add":
+                pending[record["id"]] = record["data"]
+            elif record.get("op") == "done":
+                pending.pop(record["id"], None)
+            elif record.get("op") == "rejected":
+                pending.pop(record["id"], None)
+                rejected.append(record)
+        self._spool.seek(0)
+        self._spool.truncate()
+        # Отклоненные заявки остаются в спуле для ручного разбора
+        for record in rejected:
+            self._spool.write(json.dumps(record, ensure_ascii=False) + "\n")
+        for application_id, application in pending.items():
+            self._spool.write(json.dumps({"op": "add", "id": application_id, "data": application}, ensure_ascii=False) + "\n")
+        self._sync()
+        return list(pending.items())
+
+    def _append(self, record):
+        with self._lock:
+            self._spool.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._sync()
+
+    def _sync(self):
+        self._spool.flush()
+        os.fsync(self._spool.fileno())
+
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=1)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._next_batch()
+            if not batch:
+                continue
+            with self._lock:
+                self._sending = len(batch)
+            try:
+                self._deliver(batch)
+            finally:
+                with self._lock:
+                    self._sending = 0
+
+    def _deliver(self, batch):
+        result = self._send_with_retries(batch)
+        if result == SENT:
+            for application_id, application in batch:
+                self._append({"op": "done", "id": application_id})
+                logger.info(f"Заявка сохранена: {application}")
+        elif result == REJECTED and len(batch) > 1:
+            # Отказ относится ко всей пачке: отправляем заявки по одной,
+            # чтобы отклонить только ошибочные
+            for item in batch:
+                self._deliver([item])
+        elif result == REJECTED:
+            application_id, application = batch[0]
+            self._append({"op": "rejected", "id": application_id, "data": application})
+            logger.error(f"Apps Script отклонил заявку, повторов не будет: {application}")
+        elif not self._stop.is_set():
+            logger.error(f"Не удалось отправить заявки после {self.max_retries} попыток, "
+                         f"повтор через {self.backoff_max} с: {[a for _, a in batch]}")
+            # При остановке заявки остаются в спуле до перезапуска
+            if not self._stop.wait(self.backoff_max):
+                for item in batch:
+                    self._queue.put(item)
+
+    def _send_with_retries(self, batch):
+        for attempt in range(self.max_retries):
+            result = self._post(batch)
+            if result != FAILED:
+                return result
+            delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+            if self._stop.wait(delay + random.uniform(0, delay / 10)):
+                return FAILED
+        return FAILED
+
+    def _post(self, batch):
+        if len(batch) == 1:
+            payload = batch[0][1]
+        else:
+            payload = {"applications": [application for _, application in batch]}
+        try:
+            with metrics.APPS_SCRIPT_SECONDS.time():
+                response = self.session.post(self.url, json=payload, timeout=self.timeout)
+        except requests.RequestException as e:
+            metrics.APPS_SCRIPT_REQUESTS.inc(result="error")
+            logger.error(f"Ошибка запроса к Apps Script: {e}")
+            return FAILED
+        # Сначала код ответа: 4xx (кроме временных) - запрос неверен, повтор не поможет
+        if 400 <= response.status_code < 500 and response.status_code not in RETRYABLE_CLIENT_ERRORS:
+            metrics.APPS_SCRIPT_REQUESTS.inc(result="rejected")
+            logger.error(f"Apps Script отклонил заявку: {response.status_code} {response.text[:200]!r}")
+            return REJECTED
+        if not response.ok:
+            metrics.APPS_SCRIPT_REQUESTS.inc(result="error")
+            logger.error(f"Ошибка сохранения заявки: {response.status_code}")
+            return FAILED
+        try:
+            result = response.json()
+        except ValueError:
+            result = None
+        status = result.get('status') if isinstance(result, dict) else None
+        if status == 'success':
+            metrics.APPS_SCRIPT_REQUESTS.inc(result="success")
+            return SENT
+        if status == REJECTED_STATUS:
+            metrics.APPS_SCRIPT_REQUESTS.inc(result="rejected")
+            logger.error(f"Apps Script отклонил заявку: {result}")
+            return REJECTED
+        # Ошибка скрипта или неожиданный ответ (например, HTML-страница) - повторяем
+        metrics.APPS_SCRIPT_REQUESTS.inc(result="error")
+        logger.error(f"Ошибка сохранения заявки: {response.status_code} {result if result is not None else response.text[:200]!r}")
+        return FAILED
@@ -0,0 +1,316 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+import requests
+from requests.adapters import HTTPAdapter
+from telebot.apihelper import ApiTelegramException
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+# Общая keep-alive сессия для всех потоков вместо сессий telebot на поток.
+# Подключается через apihelper.CUSTOM_REQUEST_SENDER и учитывает время запросов.
+class TelegramSession:
+    def __init__(self, pool_size=16):
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+
+    def request(self, method, url, **kwargs):
+        api_method = url.split('?', 1)[0].rsplit('/', 1)[-1]
+        status = "error"
+        try:
+            with metrics.TELEGRAM_API_SECONDS.time(method=api_method):
+                response = self.session.request(method, url, **kwargs)
+            status = str(response.status_code)
+            return response
+        finally:
+            metrics.TELEGRAM_API_REQUESTS.inc(method=api_method, status=status)
+
+
+# Корзина токенов: rate токенов в секунду, не больше capacity подряд.
+# reserve() занимает токен и возвращает, сколько нужно подождать до его появления.
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    # Пауза после 429: токенов не будет еще seconds секунд
+    def pause(self, seconds):
+        with self.lock:
+            self.tokens = min(self.tokens, 1 - seconds * self.rate)
+            self.updated = time.monotonic()
+
+
+# Ограниченный словарь с вытеснением самых старых записей
+class _BoundedDict(OrderedDict):
+    def __init__(self, maxsize):
+        super().__init__()
+        self.maxsize = maxsize
+
+    def remember(self, key, value):
+        self[key] = value
+        self.move_to_end(key)
+        while len(self) > self.maxsize:
+            self.popitem(last=False)
+
+
+# Исходящие вызовы Bot API для обработчиков: общий и поканальный лимиты,
+# повтор после 429 с учетом retry_after, отбрасывание лишних операций
+# (повторный ответ на тот же callback, правка сообщения на тот же текст,
+# устаревшая правка, которую уже перекрыла более новая).
+# Внутри pacing() (потоки пула обработчиков) в текущем потоке ждется только
+# общий лимит. Вызов, упершийся в лимит своего чата (а вне pacing() - в любой
+# лимит или 429), ставится в очередь отложенных вызовов этого чата: ее таймер
+# выполняет вызовы по порядку, и ожидание одного чата не задерживает другие
+# чаты того же потока.
+class TelegramSender:
+    def __init__(self, bot, global_rate=30, chat_rate=1, chat_burst=3, max_retries=3,
+                 max_retry_after=30, max_tracked=10000, unchanged_window=5.0, max_deferred=1000):
+        self.bot = bot
+        # Сколько секунд помним отправленный текст сообщения: правку другим
+        # процессом отсюда не видно, поэтому окно короткое (двойные нажатия)
+        self.unchanged_window = unchanged_window
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_retry_after = max_retry_after
+        self.max_deferred = max_deferred
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets = _BoundedDict(max_tracked)
+        self._answered = _BoundedDict(max_tracked)
+        self._contents = _BoundedDict(max_tracked)
+        self._edit_generations = _BoundedDict(max_tracked)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._deferred = 0
+        # Очереди отложенных вызовов по чатам: (срок, функция, args, kwargs)
+        self._chat_queues = {}
+
+    # Вызовы внутри блока ждут лимиты в текущем потоке
+    @contextmanager
+    def pacing(self):
+        previous = getattr(self._local, 'pacing', False)
+        self._local.pacing = True
+        try:
+            yield
+        finally:
+            self._local.pacing = previous
+
+    def deferred_count(self):
+        return self._deferred
+
+    def send_message(self, chat_id, text, **kwargs):
+        message = self._call(chat_id, self.bot.send_message, chat_id, text, **kwargs)
+        self._remember_content(chat_id, message, text, kwargs.get('reply_markup'))
+        return message
+
+    def reply_to(self, message, text, **kwargs):
+        sent = self._call(message.chat.id, self.bot.reply_to, message, text, **kwargs)
+        self._remember_content(message.chat.id, sent, text, kwargs.get('reply_markup'))
+        return sent
+
+    def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        key = (str(chat_id), message_id)
+        content = (text, _markup_key(kwargs.get('reply_markup')))
+        with self._lock:
+            if self._is_unchanged(key, content):
+                metrics.TELEGRAM_COALESCED.inc(operation="edit_unchanged")
+                return None
+            generation = self._edit_generations.get(key, 0) + 1
+            self._edit_generations.remember(key, generation)
+        wait = self._throttle(chat_id)
+        if wait is not None:
+            return self._defer(chat_id, wait, self._edit, key, content, generation, text, chat_id, message_id, **kwargs)
+        return self._edit(key, content, generation, text, chat_id, message_id, **kwargs)
+
+    def _edit(self, key, content, generation, text, chat_id, message_id, **kwargs):
+        with self._lock:
+            if self._edit_generations.get(key) != generation:
+                # Пока ждали лимит, пришла более новая правка того же сообщения
+                metrics.TELEGRAM_COALESCED.inc(operation="edit_superseded")
+                return None
+        try:
+            result = self._call(chat_id, self.bot.edit_message_text, text, chat_id=chat_id, message_id=message_id,
+                                throttled=True, **kwargs)
+        except ApiTelegramException as e:
+            if e.error_code == 400 and 'message is not modified' in e.description:
+                metrics.TELEGRAM_COALESCED.inc(operation="edit_unchanged")
+                return None
+            raise
+        with self._lock:
+            self._contents.remember(key, (content, time.monotonic()))
+        return result
+
+    def answer_callback_query(self, callback_query_id, text=None, **kwargs):
+        with self._lock:
+            if callback_query_id in self._answered:
+                metrics.TELEGRAM_COALESCED.inc(operation="answer_duplicate")
+                return None
+            self._answered.remember(callback_query_id, True)
+        # Ответ на callback не создает сообщений и не расходует лимиты
+        return self._call(None, self.bot.answer_callback_query, callback_query_id, text, throttled=True, **kwargs)
+
+    def _chat_bucket(self, chat_id):
+        key = str(chat_id)
+        with self._lock:
+            bucket = self._chat_buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chat_buckets.remember(key, bucket)
+        return bucket
+
+    # Токены занимаются сразу. None - вызов можно выполнить сейчас (внутри
+    # pacing() общий лимит уже выждан), иначе - на сколько его отложить.
+    # Пока у чата есть очередь отложенных вызовов, новые встают в нее же.
+    def _throttle(self, chat_id):
+        wait = self.global_bucket.reserve()
+        chat_wait = 0.0
+        if chat_id is not None:
+            chat_wait = self._chat_bucket(chat_id).reserve()
+        if max(wait, chat_wait) > 0:
+            metrics.TELEGRAM_THROTTLE_SECONDS.observe(max(wait, chat_wait))
+        if chat_wait <= 0 and not self._has_queue(chat_id):
+            if wait <= 0:
+                return None
+            if getattr(self._local, 'pacing', False):
+                time.sleep(wait)
+                return None
+        return max(wait, chat_wait, 0.0)
+
+    def _has_queue(self, chat_id):
+        if chat_id is None:
+            return False
+        with self._lock:
+            return str(chat_id) in self._chat_queues
+
+    # Выполнение вызова через delay секунд в фоновом потоке, где общий лимит
+    # можно ждать. Вызовы одного чата выполняются по порядку из его очереди.
+    def _defer(self, limited_chat_id, delay, func, *args, **kwargs):
+        return self._schedule(limited_chat_id, delay, func, args, kwargs)
+
+    # first - поставить вызов в начало очереди чата (повтор после 429)
+    def _schedule(self, limited_chat_id, delay, func, args, kwargs, first=False):
+        key = None if limited_chat_id is None else str(limited_chat_id)
+        with self._lock:
+            if self._deferred >= self.max_deferred:
+                metrics.TELEGRAM_DEFERRED.inc(result="dropped")
+                logger.error(f"Telegram: слишком много отложенных вызовов ({self._deferred}), вызов отброшен")
+                return None
+            self._deferred += 1
+            start = True
+            if key is not None:
+                entry = (time.monotonic() + delay, func, args, kwargs)
+                pending = self._chat_queues.get(key)
+                if pending is None:
+                    self._chat_queues[key] = deque([entry])
+                elif first:
+                    pending.appendleft(entry)
+                    start = False
+                else:
+                    # Таймер очереди уже запущен: вызов выполнится после предыдущих
+                    pending.append(entry)
+                    start = False
+        metrics.TELEGRAM_DEFERRED.inc(result="deferred")
+        if key is None:
+            _start_timer(delay, self._run_deferred, func, args, kwargs)
+        elif start:
+            _start_timer(delay, self._drain, key)
+        return None
+
+    def _run_deferred(self, func, args, kwargs):
+        try:
+            with self.pacing():
+                func(*args, **kwargs)
+        except Exception as e:
+            logger.error(f"Ошибка отложенного вызова Bot API: {e}")
+        finally:
+            with self._lock:
+                self._deferred -= 1
+
+    # Таймер очереди чата: выполняет наступившие вызовы по порядку и
+    # перезапускается на срок следующего; пустая очередь удаляется
+    def _drain(self, key):
+        while True:
+            with self._lock:
+                pending = self._chat_queues[key]
+                if not pending:
+                    del self._chat_queues[key]
+                    return
+                due, func, args, kwargs = pending[0]
+                delay = due - time.monotonic()
+                if delay <= 0:
+                    pending.popleft()
+            if delay > 0:
+                _start_timer(delay, self._drain, key)
+                return
+            self._run_deferred(func, args, kwargs)
+
+    def _call(self, limited_chat_id, func, *args, throttled=False, attempt=0, **kwargs):
+        while True:
+            if not throttled:
+                wait = self._throttle(limited_chat_id)
+                if wait is not None:
+                    return self._defer(limited_chat_id, wait, self._call, limited_chat_id, func, *args,
+                                       throttled=True, attempt=attempt, **kwargs)
+            throttled = False
+            try:
+                return func(*args, **kwargs)
+            except ApiTelegramException as e:
+                retry_after = _retry_after(e)
+                if retry_after is None or attempt >= self.max_retries or retry_after > self.max_retry_after:
+                    raise
+                attempt += 1
+                metrics.TELEGRAM_RETRIES.inc(method=func.__name__)
+                logger.warning(f"Telegram: 429 для {func.__name__}, повтор через {retry_after} с")
+                if limited_chat_id is not None:
+                    # Повтор - первым в очереди чата, чтобы не обогнать его сообщения
+                    self._chat_bucket(limited_chat_id).pause(retry_after)
+                    return self._schedule(limited_chat_id, retry_after, self._call, (limited_chat_id, func) + args,
+                                          dict(kwargs, throttled=True, attempt=attempt), first=True)
+                self.global_bucket.pause(retry_after)
+                if not getattr(self._local, 'pacing', False):
+                    return self._defer(None, 0, self._call, None, func, *args, attempt=attempt, **kwargs)
+
+    def _remember_content(self, chat_id, message, text, reply_markup):
+        message_id = getattr(message, 'message_id', None)
+        if message_id is not None:
+            with self._lock:
+                self._contents.remember((str(chat_id), message_id), ((text, _markup_key(reply_markup)), time.monotonic()))
+
+    def _is_unchanged(self, key, content):
+        remembered = self._contents.get(key)
+        return (remembered is not None and remembered[0] == content
+                and time.monotonic() - remembered[1] < self.unchanged_window)
+
+
+def _start_timer(delay, func, *args):
+    timer = threading.Timer(delay, func, args)
+    timer.daemon = True
+    timer.start()
+
+
+def _markup_key(reply_markup):
+    if reply_markup is None or isinstance(reply_markup, str):
+        return reply_markup
+    return reply_markup.to_json()
+
+
+def _retry_after(error):
+    if error.error_code != 429:
+        return None
+    return (error.result_json.get('parameters') or {}).get('retry_after', 1)